@@ -1,20 +1,231 @@
+import asyncio
+import functools
+import inspect
 import sqlite3
 import os
+import re
+import shutil
+import time
+import mmap
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import json
 
+from event_archive import chunk_path, month_of, read_chunk, write_chunk
+from guild_profiler import GuildLoadProfiler
+
+# Текущее время в миллисекундах эпохи для DEFAULT-значений столбцов
+NOW_MS_SQL = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def to_epoch_ms(value):
+    # Принимает datetime, строку '%Y-%m-%d %H:%M:%S' (локальное время), секунды или миллисекунды
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            # '%Y-%m-%d %H:%M:%S' и isoformat(); без часового пояса — локальное время
+            return int(datetime.fromisoformat(value).timestamp() * 1000)
+    value = float(value)
+    if value < 100000000000:
+        value *= 1000
+    return int(value)
+
+
+def from_epoch_ms(value):
+    # Обратное преобразование для вызывающего кода: миллисекунды эпохи -> локальный datetime
+    return datetime.fromtimestamp(value / 1000) if value is not None else None
+
+
+def _stored_ms(value):
+    # Значение из БД в миллисекундах; старые строки и секунды, записанные в обход to_epoch_ms, тоже читаются.
+    # Нераспознанное значение возвращается как None.
+    if type(value) is int:
+        return value
+    try:
+        return to_epoch_ms(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _epoch_ms_sql(column, local):
+    # Перевод старых значений столбца в миллисекунды при миграции.
+    # Строки, записанные через datetime.now(), хранят локальное время, CURRENT_TIMESTAMP — UTC.
+    modifier = ", 'utc'" if local else ""
+    return (
+        f"CASE WHEN {column} IS NULL THEN NULL "
+        f"WHEN typeof({column}) IN ('integer', 'real') AND {column} < 100000000000 "
+        f"THEN CAST({column} * 1000 AS INTEGER) "
+        f"WHEN typeof({column}) IN ('integer', 'real') THEN CAST({column} AS INTEGER) "
+        f"ELSE CAST(strftime('%s', {column}{modifier}) AS INTEGER) * 1000 END"
+    )
+
 class Database:
-    def __init__(self, db_path="data/data.db"):
+    # Сколько последних записей журнала cache_changes хранить для других процессов
+    CHANGE_LOG_KEEP = 10000
+    # Версия схемы в PRAGMA user_version
+    SCHEMA_VERSION = 2
+    # Столбцы со временем: таблица -> [(столбец, записывался ли он в локальном времени)]
+    TIMESTAMP_COLUMNS = {
+        "global_bans": [("timestamp", False)],
+        "action_logs": [("timestamp", False)],
+        "raid_attempts": [("timestamp", True)],
+        "protection_activations": [("timestamp", True)],
+        "role_blocks": [("timestamp", True)],
+        "channel_blocks": [("timestamp", True)],
+        "aban_usage_log": [("timestamp", True)],
+        "creact_settings": [("created_at", False)],
+        "trusted_users": [("added_at", False)],
+        "server_settings": [("created_at", False)],
+        "user_actions": [("timestamp", False)],
+        "role_actions": [("timestamp", False)],
+        "channel_actions": [("timestamp", False)],
+        "server_images": [("updated_at", False)],
+        "premium_status": [("expires_at", True)],
+    }
+    # Таблицы с составным ключом, хранящиеся как WITHOUT ROWID: таблица -> столбцы ключа
+    COMPACT_TABLES = {
+        "global_bans_servers": ("user_id", "guild_id"),
+        "antiremove_roles": ("guild_id", "user_id"),
+        "gban_allowed_roles": ("guild_id", "role_id"),
+        "aban_allowed_roles": ("guild_id", "role_id"),
+        "creact_roles": ("guild_id", "role_id"),
+        "trusted_users": ("guild_id", "user_id"),
+        "premium_status": ("user_id", "guild_id"),
+        "blacklisted_roles": ("guild_id", "role_id"),
+    }
+
+    # Таблицы с данными сервера, очищаемые при выходе бота с сервера
+    GUILD_TABLES = (
+        "global_ban_servers",
+        "global_bans_servers",
+        "antiremove_roles",
+        "gban_allowed_roles",
+        "aban_allowed_roles",
+        "action_logs",
+        "protection_status",
+        "action_limits",
+        "raid_attempts",
+        "protection_activations",
+        "role_blocks",
+        "channel_blocks",
+        "aban_usage_log",
+        "creact_settings",
+        "creact_roles",
+        "trusted_users",
+        "server_settings",
+        "user_actions",
+        "role_actions",
+        "channel_actions",
+        "server_images",
+        "premium_status",
+        "blacklisted_roles",
+        "archive_chunks",
+        "snapshot_objects",
+        "guild_snapshots",
+    )
+    # Журналы, старые записи которых переносятся в архив: таблица -> столбцы без guild_id (id — первый)
+    ARCHIVE_TABLES = {
+        "aban_usage_log": ("id", "admin_id", "target_id", "timestamp"),
+        "action_logs": ("id", "user_id", "action_type", "timestamp"),
+        "role_blocks": ("id", "role_id", "timestamp"),
+        "channel_blocks": ("id", "channel_id", "timestamp"),
+    }
+    # Возраст записей, после которого archive_events() переносит их в архив (90 дней)
+    ARCHIVE_AFTER_MS = 90 * 86400000
+    # Сколько серверов удаляется в одном запросе DELETE ... IN (...)
+    PURGE_CHUNK = 500
+    # Сколько отложенных записей log_aban_usage копить до принудительной записи
+    DEFERRED_LIMIT = 1000
+    # Сколько миллисекунд отложенная запись может ждать в памяти
+    DEFERRED_MAX_AGE_MS = 5000
+    # Пауза перед повторной записью после ошибки (секунды): удваивается до DEFERRED_RETRY_MAX
+    DEFERRED_RETRY = 1.0
+    DEFERRED_RETRY_MAX = 60.0
+    # Снимок кешей: сигнатура, версия формата, версия схемы, позиция журнала, длина и CRC32 данных
+    SNAPSHOT_MAGIC = b"ARBCACHE"
+    SNAPSHOT_VERSION = 1
+    SNAPSHOT_HEADER = struct.Struct("<8sHIqII")
+
+    def __init__(self, db_path="data/data.db", snapshot_path=None, archive_dir=None):
+        started = time.perf_counter()
+        # Нагрузка по серверам: заполняется обёртками методов с аргументом guild_id
+        self.profiler = GuildLoadProfiler()
+        self._profile_depth = 0
+        # Некритичные записи шумных серверов, ожидающие flush_deferred_writes()
+        self._deferred_aban_usage = []
+        self._deferred_failures = 0
+        self._deferred_retry_at = 0.0
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.snapshot_path = snapshot_path or f"{db_path}.cache"
+        self.archive_dir = archive_dir or os.path.join(os.path.dirname(db_path), "archive")
         self.connection = sqlite3.connect(db_path)
         self.cursor = self.connection.cursor()
-        self.global_ban_servers = set()
-        self.gban_allowed_roles = {}
+        self._global_ban_servers = set()
+        self._gban_allowed_roles = {}
         self.global_bans = {}
+        # Позиция в журнале изменений и PRAGMA data_version на момент последней синхронизации
+        self._last_change_id = 0
+        self._data_version = None
+        self._syncing = False
+        # Таблица -> функция перезагрузки кеша для одного сервера
+        self._cache_loaders = {
+            "global_ban_servers": self._reload_global_ban_servers,
+            "gban_allowed_roles": self._reload_gban_allowed_roles,
+        }
+        # Кеш -> функция полной загрузки через переданный курсор
+        self._cache_fetchers = {
+            "global_ban_servers": self._fetch_global_ban_servers,
+            "gban_allowed_roles": self._fetch_gban_allowed_roles,
+        }
+        # Кеши, которые ещё прогреваются в фоне: имя -> Future
+        self._warmup = {}
+        self.startup_report = {}
         self._create_tables()
         self._ensure_guild_ids_column()
-        self._load_data_to_memory()
-        self.global_ban_servers = set()
+        self._migrate()
+        self._create_indexes()
+        self._fts_enabled = self._create_search_index()
+        self._started = started
+        if self._load_snapshot():
+            self._finish_startup("snapshot")
+        else:
+            self._start_warmup()
+
+    def _cache(self, name):
+        # Единая точка чтения кешей: дожидаемся прогрева и подтягиваем изменения других процессов
+        self._ensure_cache(name)
+        self.sync_caches()
+        return getattr(self, f"_{name}")
+
+    @property
+    def global_ban_servers(self):
+        return self._cache("global_ban_servers")
+
+    @global_ban_servers.setter
+    def global_ban_servers(self, value):
+        self._warmup.pop("global_ban_servers", None)
+        self._global_ban_servers = value
+
+    @property
+    def gban_allowed_roles(self):
+        return self._cache("gban_allowed_roles")
+
+    @gban_allowed_roles.setter
+    def gban_allowed_roles(self, value):
+        self._warmup.pop("gban_allowed_roles", None)
+        self._gban_allowed_roles = value
 
     def _ensure_guild_ids_column(self):
         try:
@@ -26,20 +237,364 @@ class Database:
         except sqlite3.Error as e:
             print(f"[Ошибка БД] Не удалось добавить столбец guild_ids: {e}")
 
+    def _mark_change_position(self):
+        # Позицию журнала читаем до данных: изменения, попавшие между запросами, применятся повторно
+        self.cursor.execute("PRAGMA data_version")
+        self._data_version = self.cursor.fetchone()[0]
+        self.cursor.execute("SELECT COALESCE(MAX(id), 0) FROM cache_changes")
+        self._last_change_id = self.cursor.fetchone()[0]
+
     def _load_data_to_memory(self):
         try:
-            self.cursor.execute("SELECT guild_id FROM global_ban_servers")
-            self.global_ban_servers = {row[0] for row in self.cursor.fetchall()}
-            self.cursor.execute("SELECT guild_id, role_id FROM gban_allowed_roles")
-            for guild_id, role_id in self.cursor.fetchall():
-                if guild_id not in self.gban_allowed_roles:
-                    self.gban_allowed_roles[guild_id] = set()
-                self.gban_allowed_roles[guild_id].add(role_id)
+            self._mark_change_position()
+            for name, fetch in self._cache_fetchers.items():
+                setattr(self, name, fetch(self.cursor))
         except sqlite3.Error as e:
             print(f"[Ошибка БД] Не удалось загрузить данные в память: {e}")
 
-    def _create_tables(self):
+    @staticmethod
+    def _fetch_global_ban_servers(cursor):
+        cursor.execute("SELECT guild_id FROM global_ban_servers")
+        return {row[0] for row in cursor.fetchall()}
+
+    @staticmethod
+    def _fetch_gban_allowed_roles(cursor):
+        roles = {}
+        cursor.execute("SELECT guild_id, role_id FROM gban_allowed_roles")
+        for guild_id, role_id in cursor.fetchall():
+            roles.setdefault(guild_id, set()).add(role_id)
+        return roles
+
+    def _warmup_cache(self, name):
+        # Выполняется в отдельном потоке со своим соединением
+        started = time.perf_counter()
+        connection = sqlite3.connect(self.db_path)
+        try:
+            data = self._cache_fetchers[name](connection.cursor())
+            finished = time.perf_counter()
+            return data, (finished - started) * 1000, finished
+        finally:
+            connection.close()
+
+    def _start_warmup(self):
+        try:
+            self._mark_change_position()
+        except sqlite3.Error as e:
+            print(f"[Ошибка БД] Не удалось прочитать позицию журнала изменений: {e}")
+        self.startup_report = {"source": "warmup", "caches": {}}
+        self._warmup_finished = 0
+        executor = ThreadPoolExecutor(max_workers=len(self._cache_fetchers))
+        self._warmup = {name: executor.submit(self._warmup_cache, name) for name in self._cache_fetchers}
+        executor.shutdown(wait=False)
+
+    def _ensure_cache(self, name):
+        # Кеш подставляется при первом обращении, дожидаясь фоновой загрузки только его
+        if not self._warmup or name not in self._warmup:
+            return
+        future = self._warmup.pop(name)
+        try:
+            data, elapsed, finished = future.result()
+        except sqlite3.Error as e:
+            print(f"[Ошибка БД] Не удалось прогреть кеш {name}: {e}")
+            data, elapsed, finished = self._cache_fetchers[name](self.cursor), None, time.perf_counter()
+        setattr(self, f"_{name}", data)
+        self.startup_report["caches"][name] = elapsed
+        self._warmup_finished = max(self._warmup_finished, finished)
+        if not self._warmup:
+            self._finish_startup("warmup", self._warmup_finished)
+
+    def wait_warmup(self):
+        for name in list(self._warmup):
+            self._ensure_cache(name)
+        return self.startup_report
+
+    def _finish_startup(self, source, finished=None):
+        # Время считаем до окончания загрузки, а не до первого обращения к кешу
+        finished = finished or time.perf_counter()
+        self.startup_report["source"] = source
+        self.startup_report["total_ms"] = (finished - self._started) * 1000
+        self.startup_report.setdefault("caches", {})
+        details = ", ".join(
+            f"{name}: {elapsed:.1f} мс" for name, elapsed in self.startup_report["caches"].items() if elapsed is not None
+        )
+        source_text = "из снимка" if source == "snapshot" else "из БД"
+        print(
+            f"[БД] Кеши загружены {source_text} за {self.startup_report['total_ms']:.1f} мс"
+            + (f" ({details})" if details else "")
+        )
+
+    def _dump_caches(self):
+        return {
+            "global_ban_servers": sorted(self._global_ban_servers),
+            "gban_allowed_roles": {str(guild_id): sorted(roles) for guild_id, roles in self._gban_allowed_roles.items()},
+        }
+
+    def _restore_caches(self, data):
+        self._global_ban_servers = set(data["global_ban_servers"])
+        self._gban_allowed_roles = {int(guild_id): set(roles) for guild_id, roles in data["gban_allowed_roles"].items()}
+
+    def save_snapshot(self):
+        # Сохраняет кеши в файл снимка; вызывается при штатной остановке из close()
+        try:
+            self.wait_warmup()
+            self.sync_caches(force=True)
+            payload = json.dumps(self._dump_caches(), separators=(",", ":")).encode()
+            header = self.SNAPSHOT_HEADER.pack(
+                self.SNAPSHOT_MAGIC, self.SNAPSHOT_VERSION, self.SCHEMA_VERSION,
+                self._last_change_id, len(payload), zlib.crc32(payload)
+            )
+            tmp_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(header)
+                f.write(payload)
+            os.replace(tmp_path, self.snapshot_path)
+            return True
+        except (OSError, sqlite3.Error) as e:
+            print(f"[Ошибка БД] Не удалось сохранить снимок кешей: {e}")
+            return False
+
+    def _load_snapshot(self):
+        # Снимок годится, только если с момента его записи журнал cache_changes не сдвинулся.
+        # PRAGMA data_version не переживает переподключение, поэтому сверяемся с позицией журнала.
+        started = time.perf_counter()
+        try:
+            with open(self.snapshot_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, version, schema_version, change_id, length, crc = self.SNAPSHOT_HEADER.unpack_from(mm, 0)
+                if magic != self.SNAPSHOT_MAGIC or version != self.SNAPSHOT_VERSION:
+                    return False
+                if schema_version != self.SCHEMA_VERSION:
+                    return False
+                payload = mm[self.SNAPSHOT_HEADER.size:self.SNAPSHOT_HEADER.size + length]
+            if len(payload) != length or zlib.crc32(payload) != crc:
+                print("[БД] Снимок кешей повреждён, загружаем данные из БД")
+                return False
+            self._mark_change_position()
+            if change_id != self._last_change_id:
+                return False
+            self._restore_caches(json.loads(payload))
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, struct.error, sqlite3.Error) as e:
+            print(f"[БД] Не удалось прочитать снимок кешей: {e}")
+            return False
+        self.startup_report = {"source": "snapshot", "caches": {"snapshot": (time.perf_counter() - started) * 1000}}
+        return True
+
+    def _reload_global_ban_servers(self, guild_id):
+        self.cursor.execute("SELECT 1 FROM global_ban_servers WHERE guild_id = ?", (guild_id,))
+        if self.cursor.fetchone():
+            self.global_ban_servers.add(guild_id)
+        else:
+            self.global_ban_servers.discard(guild_id)
+
+    def _reload_gban_allowed_roles(self, guild_id):
+        self.cursor.execute("SELECT role_id FROM gban_allowed_roles WHERE guild_id = ?", (guild_id,))
+        roles = {row[0] for row in self.cursor.fetchall()}
+        if roles:
+            self.gban_allowed_roles[guild_id] = roles
+        else:
+            self.gban_allowed_roles.pop(guild_id, None)
+
+    def _record_change(self, table_name, guild_id):
+        # Вызывается до commit(), поэтому запись попадает в ту же транзакцию, что и само изменение
+        self.cursor.execute(
+            "INSERT INTO cache_changes (table_name, guild_id) VALUES (?, ?)",
+            (table_name, guild_id)
+        )
+        if self.cursor.lastrowid % self.CHANGE_LOG_KEEP == 0:
+            self.cursor.execute(
+                "DELETE FROM cache_changes WHERE id <= ?",
+                (self.cursor.lastrowid - self.CHANGE_LOG_KEEP,)
+            )
+
+    # Применяет изменения кешируемых таблиц, сделанные другими процессами
+    def sync_caches(self, force=False):
+        # Загрузчики обращаются к кешам через свойства — не даём им запустить синхронизацию повторно
+        if self._syncing:
+            return 0
+        self._syncing = True
         try:
+            # data_version меняется только после коммитов других соединений
+            self.cursor.execute("PRAGMA data_version")
+            data_version = self.cursor.fetchone()[0]
+            if data_version == self._data_version and not force:
+                return 0
+            self._data_version = data_version
+
+            self.cursor.execute(
+                "SELECT id, table_name, guild_id FROM cache_changes WHERE id > ? ORDER BY id",
+                (self._last_change_id,)
+            )
+            changes = self.cursor.fetchall()
+            if not changes:
+                return 0
+            if changes[0][0] != self._last_change_id + 1:
+                # Нужная часть журнала уже удалена — перечитываем кеши целиком
+                self._load_data_to_memory()
+                return len(changes)
+
+            self._last_change_id = changes[-1][0]
+            affected = {(table_name, guild_id) for _, table_name, guild_id in changes}
+            for table_name, guild_id in affected:
+                loader = self._cache_loaders.get(table_name)
+                if loader is not None:
+                    loader(guild_id)
+            return len(affected)
+        except sqlite3.Error as e:
+            print(f"[Ошибка БД] sync_caches: {e}")
+            return 0
+        finally:
+            self._syncing = False
+
+    def _migrate(self):
+        self.cursor.execute("PRAGMA user_version")
+        version = self.cursor.fetchone()[0]
+        if version >= self.SCHEMA_VERSION:
+            return
+        rebuilt = False
+        try:
+            self.cursor.execute("BEGIN")
+            if version < 1:
+                self._migrate_epoch_ms()
+            if version < 2:
+                rebuilt = self._migrate_compact_tables()
+            self.cursor.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            self.connection.commit()
+        except sqlite3.Error as e:
+            self.connection.rollback()
+            print(f"[Ошибка БД] Не удалось обновить схему с версии {version}: {e}")
+            return
+        if rebuilt:
+            # Освободившиеся после пересборки страницы возвращаются только после VACUUM.
+            # Схема уже обновлена, поэтому при ошибке (нет места, занята БД) просто продолжаем работу.
+            try:
+                self.cursor.execute("VACUUM")
+            except sqlite3.Error as e:
+                print(f"[Ошибка БД] Не удалось выполнить VACUUM после миграции: {e}")
+
+    def _migrate_epoch_ms(self):
+        for table, columns in self.TIMESTAMP_COLUMNS.items():
+            self.cursor.execute(f"PRAGMA table_info({table})")
+            types = {col[1]: col[2].upper() for col in self.cursor.fetchall()}
+            if all(types.get(column) == "INTEGER" for column, _ in columns):
+                continue
+            self._rebuild_table(table, {column: _epoch_ms_sql(column, local) for column, local in columns})
+
+    def _migrate_compact_tables(self):
+        rebuilt = False
+        self.cursor.execute("PRAGMA table_info(action_logs)")
+        types = {col[1]: col[2].upper() for col in self.cursor.fetchall()}
+        if types.get("guild_id") != "INTEGER":
+            self._rebuild_table("action_logs", {
+                "guild_id": "CAST(guild_id AS INTEGER)",
+                "user_id": "CAST(user_id AS INTEGER)",
+            })
+            rebuilt = True
+        for table, keys in self.COMPACT_TABLES.items():
+            self.cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+            if "WITHOUT ROWID" in self.cursor.fetchone()[0].upper():
+                continue
+            # В WITHOUT ROWID-таблицах ключ не может быть NULL, такие строки всё равно были недостижимы
+            self._rebuild_table(table, {}, " AND ".join(f"{key} IS NOT NULL" for key in keys))
+            rebuilt = True
+        return rebuilt
+
+    def _rebuild_table(self, table, conversions, where=None):
+        # Пересоздаёт таблицу по актуальной схеме из _create_tables, переводя столбцы выражениями conversions.
+        # Вызывается только внутри открытой транзакции миграции.
+        self.cursor.execute(f"PRAGMA table_info({table})")
+        old_columns = {col[1] for col in self.cursor.fetchall()}
+        self.cursor.execute(f"ALTER TABLE {table} RENAME TO {table}__old")
+        self._create_tables(commit=False)
+        self.cursor.execute(f"PRAGMA table_info({table})")
+        columns = [col[1] for col in self.cursor.fetchall() if col[1] in old_columns]
+        select = ", ".join(conversions.get(column, column) for column in columns)
+        self.cursor.execute(
+            f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) SELECT {select} FROM {table}__old"
+            + (f" WHERE {where}" if where else "")
+        )
+        self.cursor.execute(f"DROP TABLE {table}__old")
+
+    def _create_indexes(self):
+        try:
+            self.cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_action_logs_user "
+                "ON action_logs (guild_id, user_id, action_type, timestamp)"
+            )
+            self.cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_aban_usage_log_guild ON aban_usage_log (guild_id, timestamp)"
+            )
+            self.cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_raid_attempts_guild ON raid_attempts (guild_id, timestamp)"
+            )
+            # Индексы по guild_id для таблиц, где он не первый столбец ключа — нужны для purge_guilds
+            for table in ("protection_activations", "role_blocks", "channel_blocks",
+                          "user_actions", "role_actions", "channel_actions"):
+                self.cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_{table}_guild ON {table} (guild_id, timestamp)"
+                )
+            self.cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_guild_snapshots_guild ON guild_snapshots (guild_id, id)"
+            )
+            for table in ("global_bans_servers", "premium_status"):
+                self.cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_guild ON {table} (guild_id)")
+            self.connection.commit()
+        except sqlite3.Error as e:
+            print(f"[Ошибка БД] Не удалось создать индексы: {e}")
+
+    def _create_search_index(self):
+        # Полнотекстовый индекс по причинам глобальных банов (external content над global_bans).
+        # Если индекс или триггеры отсутствовали (первый запуск, пересборка таблицы), индекс перестраивается.
+        try:
+            self.cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE name IN "
+                "('global_bans_fts', 'global_bans_fts_insert', 'global_bans_fts_delete', 'global_bans_fts_update')"
+            )
+            complete = self.cursor.fetchone()[0] == 4
+            self.cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS global_bans_fts USING fts5(
+                    reason,
+                    content='global_bans',
+                    content_rowid='user_id',
+                    tokenize='unicode61 remove_diacritics 2',
+                    prefix='4'
+                )
+            ''')
+            self.cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS global_bans_fts_insert AFTER INSERT ON global_bans BEGIN
+                    INSERT INTO global_bans_fts (rowid, reason) VALUES (new.user_id, new.reason);
+                END
+            ''')
+            self.cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS global_bans_fts_delete AFTER DELETE ON global_bans BEGIN
+                    INSERT INTO global_bans_fts (global_bans_fts, rowid, reason) VALUES ('delete', old.user_id, old.reason);
+                END
+            ''')
+            self.cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS global_bans_fts_update AFTER UPDATE ON global_bans BEGIN
+                    INSERT INTO global_bans_fts (global_bans_fts, rowid, reason) VALUES ('delete', old.user_id, old.reason);
+                    INSERT INTO global_bans_fts (rowid, reason) VALUES (new.user_id, new.reason);
+                END
+            ''')
+            if not complete:
+                self.cursor.execute("INSERT INTO global_bans_fts (global_bans_fts) VALUES ('rebuild')")
+            self.connection.commit()
+            return True
+        except sqlite3.OperationalError as e:
+            # SQLite собран без FTS5 — поиск будет работать через LIKE
+            self.connection.rollback()
+            print(f"[БД] Полнотекстовый поиск недоступен: {e}")
+            return False
+
+    def _create_tables(self, commit=True):
+        try:
+            self.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS cache_changes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    table_name TEXT NOT NULL,
+                    guild_id INTEGER
+                )
+            ''')
             self.cursor.execute('''
                 CREATE TABLE IF NOT EXISTS global_ban_servers (
                     guild_id INTEGER PRIMARY KEY,
@@ -49,31 +604,31 @@ class Database:
             ''')
             self.cursor.execute('''
                 CREATE TABLE IF NOT EXISTS global_bans_servers (
-                    user_id INTEGER,
-                    guild_id INTEGER,
+                    user_id INTEGER NOT NULL,
+                    guild_id INTEGER NOT NULL,
                     PRIMARY KEY (user_id, guild_id)
-                )
+                ) WITHOUT ROWID
             ''')
             self.cursor.execute('''
                 CREATE TABLE IF NOT EXISTS antiremove_roles (
-                    guild_id INTEGER,
-                    user_id INTEGER,
+                    guild_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
                     PRIMARY KEY (guild_id, user_id)
-                )
+                ) WITHOUT ROWID
             ''')
 
             self.cursor.execute('''
                 CREATE TABLE IF NOT EXISTS gban_allowed_roles (
-                    guild_id INTEGER,
-                    role_id INTEGER,
+                    guild_id INTEGER NOT NULL,
+                    role_id INTEGER NOT NULL,
                     PRIMARY KEY (guild_id, role_id)
-                )
+                ) WITHOUT ROWID
             ''')
 
             self.cursor.execute('''
                 CREATE TABLE IF NOT EXISTS global_bans (
                     user_id INTEGER PRIMARY KEY,
-                    timestamp REAL NOT NULL,
+                    timestamp INTEGER NOT NULL,
                     reason TEXT,
                     issuer_id INTEGER,
                     owner_id INTEGER, -- <-- ДОБАВЛЕНО: ID владельца сети
@@ -82,19 +637,19 @@ class Database:
             ''')
             self.cursor.execute('''
                 CREATE TABLE IF NOT EXISTS aban_allowed_roles (
-                    guild_id INTEGER,
-                    role_id INTEGER,
+                    guild_id INTEGER NOT NULL,
+                    role_id INTEGER NOT NULL,
                     PRIMARY KEY (guild_id, role_id)
-                )
+                ) WITHOUT ROWID
             ''')
 
-            self.cursor.execute('''
+            self.cursor.execute(f'''
                 CREATE TABLE IF NOT EXISTS action_logs (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    guild_id TEXT NOT NULL,
-                    user_id TEXT NOT NULL,
+                    guild_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
                     action_type TEXT NOT NULL,  -- 'role_create', 'role_delete', 'channel_create', etc.
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                    timestamp INTEGER DEFAULT ({NOW_MS_SQL})
                 )
             ''')
 
@@ -116,128 +671,177 @@ class Database:
             self.cursor.execute('''CREATE TABLE IF NOT EXISTS raid_attempts (
                                   id INTEGER PRIMARY KEY AUTOINCREMENT,
                                   guild_id INTEGER,
-                                  timestamp TEXT)''')
+                                  timestamp INTEGER)''')
 
             self.cursor.execute('''CREATE TABLE IF NOT EXISTS protection_activations (
                                   id INTEGER PRIMARY KEY AUTOINCREMENT,
                                   guild_id INTEGER,
-                                  timestamp TEXT)''')
+                                  timestamp INTEGER)''')
 
             self.cursor.execute('''CREATE TABLE IF NOT EXISTS role_blocks (
                                   id INTEGER PRIMARY KEY AUTOINCREMENT,
                                   guild_id INTEGER,
                                   role_id INTEGER,
-                                  timestamp TEXT)''')
+                                  timestamp INTEGER)''')
 
             self.cursor.execute('''CREATE TABLE IF NOT EXISTS channel_blocks (
                                   id INTEGER PRIMARY KEY AUTOINCREMENT,
                                   guild_id INTEGER,
                                   channel_id INTEGER,
-                                  timestamp TEXT)''')
+                                  timestamp INTEGER)''')
 
-            self.cursor.execute('''
+            self.cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS aban_usage_log (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 guild_id INTEGER,
                 admin_id INTEGER,
                 target_id INTEGER,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                timestamp INTEGER DEFAULT ({NOW_MS_SQL})
             )
             ''')
 
             # --- Creact Settings ---
-            self.cursor.execute('''
+            self.cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS creact_settings (
                 guild_id INTEGER PRIMARY KEY,
                 enabled INTEGER DEFAULT 0,
                 emoji TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at INTEGER DEFAULT ({NOW_MS_SQL})
             )
             ''')
 
             self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS creact_roles (
-                guild_id INTEGER,
-                role_id INTEGER,
+                guild_id INTEGER NOT NULL,
+                role_id INTEGER NOT NULL,
                 PRIMARY KEY (guild_id, role_id)
-            )
+            ) WITHOUT ROWID
             ''')
 
-            self.cursor.execute('''
+            self.cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS trusted_users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                guild_id INTEGER,
-                user_id INTEGER,
-                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(guild_id, user_id)
-            )
+                guild_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                added_at INTEGER DEFAULT ({NOW_MS_SQL}),
+                PRIMARY KEY (guild_id, user_id)
+            ) WITHOUT ROWID
             ''')
 
-            self.cursor.execute('''
+            self.cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS server_settings (
                 guild_id INTEGER PRIMARY KEY,
                 freeze_mode INTEGER DEFAULT 0,           -- 0 = выключен, 1 = включён
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at INTEGER DEFAULT ({NOW_MS_SQL})
             )
             ''')
 
-            self.cursor.execute('''
+            self.cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS user_actions (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 guild_id INTEGER,
                 user_id INTEGER,
                 action_type TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                timestamp INTEGER DEFAULT ({NOW_MS_SQL})
             )
             ''')
 
-            self.cursor.execute('''
+            self.cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS role_actions (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 guild_id INTEGER,
                 user_id INTEGER,
                 action_type TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                timestamp INTEGER DEFAULT ({NOW_MS_SQL})
             )
             ''')
 
-            self.cursor.execute('''
+            self.cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS channel_actions (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 guild_id INTEGER,
                 user_id INTEGER,
                 action_type TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                timestamp INTEGER DEFAULT ({NOW_MS_SQL})
             )
             ''')
 
-            self.cursor.execute('''
+            self.cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS server_images (
                 guild_id INTEGER PRIMARY KEY,
                 image_url TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                updated_at INTEGER DEFAULT ({NOW_MS_SQL})
             )
             ''')
 
             self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS premium_status (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                guild_id INTEGER,
-                expires_at TIMESTAMP,
-                UNIQUE(user_id, guild_id)
-            )
+                user_id INTEGER NOT NULL,
+                guild_id INTEGER NOT NULL,
+                expires_at INTEGER,
+                PRIMARY KEY (user_id, guild_id)
+            ) WITHOUT ROWID
             ''')
 
             self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS blacklisted_roles (
-                guild_id INTEGER,
-                role_id INTEGER,
+                guild_id INTEGER NOT NULL,
+                role_id INTEGER NOT NULL,
                 PRIMARY KEY (guild_id, role_id)
+            ) WITHOUT ROWID
+            ''')
+
+            # Индекс архивных чанков: по одному файлу на таблицу, сервер и месяц
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS archive_chunks (
+                table_name TEXT NOT NULL,
+                guild_id INTEGER NOT NULL,
+                month TEXT NOT NULL,
+                row_count INTEGER NOT NULL,
+                min_ts INTEGER NOT NULL,
+                max_ts INTEGER NOT NULL,
+                PRIMARY KEY (guild_id, table_name, month)
+            ) WITHOUT ROWID
+            ''')
+
+            # Снимки структуры сервера: объекты (роли, каналы) хранятся один раз по хешу содержимого,
+            # снимок — набор изменений относительно parent_id (NULL у полного снимка)
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS guild_snapshots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                guild_id INTEGER NOT NULL,
+                parent_id INTEGER,
+                created_at INTEGER NOT NULL
             )
             ''')
 
-            self.connection.commit()
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS snapshot_objects (
+                guild_id INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (guild_id, hash)
+            ) WITHOUT ROWID
+            ''')
+
+            # hash = NULL — объект удалён по сравнению с родительским снимком
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS snapshot_entries (
+                snapshot_id INTEGER NOT NULL,
+                object_key TEXT NOT NULL,
+                hash TEXT,
+                PRIMARY KEY (snapshot_id, object_key)
+            ) WITHOUT ROWID
+            ''')
+
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS guild_tombstones (
+                guild_id INTEGER PRIMARY KEY,
+                purge_after INTEGER NOT NULL
+            )
+            ''')
+
+            if commit:
+                self.connection.commit()
         except sqlite3.Error as e:
             print(f"\nОшибка создания таблиц:\n{e}")
 
@@ -247,6 +851,7 @@ class Database:
                 "INSERT OR IGNORE INTO global_ban_servers (guild_id, owner_id, enabled) VALUES (?, ?, 1)",
                 (guild_id, owner_id)
             )
+            self._record_change("global_ban_servers", guild_id)
             self.connection.commit()
             self.global_ban_servers.add(guild_id)
         except sqlite3.Error as e:
@@ -257,6 +862,7 @@ class Database:
     def remove_global_ban_server(self, guild_id):
         try:
             self.cursor.execute("DELETE FROM global_ban_servers WHERE guild_id = ?", (guild_id,))
+            self._record_change("global_ban_servers", guild_id)
             self.connection.commit()
             self.global_ban_servers.discard(guild_id)
             return True
@@ -294,13 +900,20 @@ class Database:
         try:
             guild_ids = ban_data.get("guild_ids", [])
             owner_id = ban_data.get("owner_id") 
+            # UPSERT вместо INSERT OR REPLACE: при REPLACE не срабатывает триггер удаления из global_bans_fts
             self.cursor.execute("""
-                INSERT OR REPLACE INTO global_bans 
+                INSERT INTO global_bans 
                 (user_id, timestamp, reason, issuer_id, owner_id, guild_ids) 
                 VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    timestamp = excluded.timestamp,
+                    reason = excluded.reason,
+                    issuer_id = excluded.issuer_id,
+                    owner_id = excluded.owner_id,
+                    guild_ids = excluded.guild_ids
             """, (
                 user_id,
-                ban_data["timestamp"],
+                to_epoch_ms(ban_data["timestamp"]),
                 ban_data["reason"],
                 ban_data["issuer_id"],
                 owner_id, 
@@ -312,6 +925,53 @@ class Database:
             print(f"[Ошибка БД] add_global_ban: {e}")
             return False
 
+    def search_global_bans(self, query, owner_id=None, limit=20, offset=0):
+        # Все слова должны встретиться в причине; слова от 4 букв ищутся как префикс ("скам" -> "скамер").
+        # Короткие префиксы раскрываются в слишком много терминов и замедляют ранжирование.
+        words = re.findall(r"\w+", query)
+        if not words:
+            return []
+        try:
+            if self._fts_enabled:
+                match = " ".join(f'"{word}"*' if len(word) >= 4 else f'"{word}"' for word in words)
+                self.cursor.execute(f"""
+                    SELECT b.user_id, b.timestamp, b.reason, b.issuer_id, b.owner_id, b.guild_ids,
+                           snippet(global_bans_fts, 0, '**', '**', '…', 12)
+                    FROM global_bans_fts
+                    JOIN global_bans b ON b.user_id = global_bans_fts.rowid
+                    WHERE global_bans_fts MATCH ?{" AND b.owner_id = ?" if owner_id is not None else ""}
+                    ORDER BY rank
+                    LIMIT ? OFFSET ?
+                """, (match,) + ((owner_id,) if owner_id is not None else ()) + (limit, offset))
+            else:
+                conditions = ["reason LIKE ?"] * len(words)
+                params = [f"%{word}%" for word in words]
+                if owner_id is not None:
+                    conditions.append("owner_id = ?")
+                    params.append(owner_id)
+                self.cursor.execute(f"""
+                    SELECT user_id, timestamp, reason, issuer_id, owner_id, guild_ids, reason
+                    FROM global_bans
+                    WHERE {" AND ".join(conditions)}
+                    ORDER BY timestamp DESC
+                    LIMIT ? OFFSET ?
+                """, params + [limit, offset])
+            return [
+                {
+                    "user_id": row[0],
+                    "timestamp": row[1],
+                    "reason": row[2],
+                    "issuer_id": row[3],
+                    "owner_id": row[4],
+                    "guild_ids": json.loads(row[5]) if row[5] else [],
+                    "snippet": row[6],
+                }
+                for row in self.cursor.fetchall()
+            ]
+        except sqlite3.Error as e:
+            print(f"[Ошибка БД] search_global_bans: {e}")
+            return []
+
     def remove_global_ban(self, user_id):
         try:
             self.cursor.execute("DELETE FROM global_bans WHERE user_id = ?", (user_id,))
@@ -339,6 +999,7 @@ class Database:
                 INSERT OR IGNORE INTO gban_allowed_roles 
                 (guild_id, role_id) VALUES (?, ?)
             """, (guild_id, role_id))
+            self._record_change("gban_allowed_roles", guild_id)
             self.connection.commit()
             return True
         except sqlite3.Error as e:
@@ -353,6 +1014,7 @@ class Database:
                 DELETE FROM gban_allowed_roles 
                 WHERE guild_id = ? AND role_id = ?
             """, (guild_id, role_id))
+            self._record_change("gban_allowed_roles", guild_id)
             self.connection.commit()
             return True
         except sqlite3.Error as e:
@@ -361,22 +1023,36 @@ class Database:
 
     def check_premium_status(self, user_id):
         try:
+            # expires_at — INTEGER после миграции и set_premium_status, сравнение целиком в SQL
             self.cursor.execute(
-                "SELECT expires_at FROM premium_status WHERE user_id = ? AND expires_at > ?",
-                (user_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                "SELECT 1 FROM premium_status WHERE user_id = ? AND expires_at > ? LIMIT 1",
+                (user_id, now_ms())
             )
             return self.cursor.fetchone() is not None
         except sqlite3.Error:
             return False
 
+    def set_premium_status(self, user_id, guild_id, expires_at):
+        # expires_at — datetime, секунды или миллисекунды эпохи
+        try:
+            self.cursor.execute(
+                "INSERT OR REPLACE INTO premium_status (user_id, guild_id, expires_at) VALUES (?, ?, ?)",
+                (user_id, guild_id, to_epoch_ms(expires_at))
+            )
+            self.connection.commit()
+            return True
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"Ошибка установки премиум-статуса: {e}")
+            return False
+
     def set_server_image(self, guild_id, image_url):
         try:
             self.cursor.execute(
                 """
                 INSERT OR REPLACE INTO server_images (guild_id, image_url, updated_at) 
-                VALUES (?, ?, CURRENT_TIMESTAMP)
+                VALUES (?, ?, ?)
                 """,
-                (guild_id, image_url)
+                (guild_id, image_url, now_ms())
             )
             self.connection.commit()
             return True
@@ -404,9 +1080,15 @@ class Database:
             )
             result = self.cursor.fetchone()
             if result:
-                expires_at = datetime.strptime(result[0], '%Y-%m-%d %H:%M:%S')
-                if expires_at > datetime.now():
-                    return {"is_premium": True, "expires_at": result[0]}
+                expires_at = _stored_ms(result[0])
+                if expires_at is not None and expires_at > now_ms():
+                    if expires_at != result[0]:
+                        self.cursor.execute(
+                            "UPDATE premium_status SET expires_at = ? WHERE user_id = ? AND guild_id = ?",
+                            (expires_at, user_id, guild_id)
+                        )
+                        self.connection.commit()
+                    return {"is_premium": True, "expires_at": expires_at}
                 else:
                     self.cursor.execute(
                         "DELETE FROM premium_status WHERE user_id = ? AND guild_id = ?",
@@ -527,36 +1209,168 @@ class Database:
             return False
 
     def log_aban_usage(self, guild_id, admin_id, target_id):
+        # Для сервера, который сейчас перегружает БД, запись откладывается и пишется пачкой позже
+        timestamp = now_ms()
+        # Буфер сбрасывается и по возрасту: нагрузка сервера могла спасть, и новых отложенных записей не будет
+        oldest = self._deferred_aban_usage[0][3] if self._deferred_aban_usage else timestamp
+        stale = timestamp - oldest >= self.DEFERRED_MAX_AGE_MS
+        if self.profiler.is_heavy(guild_id):
+            self._deferred_aban_usage.append((guild_id, admin_id, target_id, timestamp))
+            if stale or len(self._deferred_aban_usage) >= self.DEFERRED_LIMIT:
+                if not self.flush_deferred_writes():
+                    self._trim_deferred_writes()
+            return True
+        if stale:
+            self.flush_deferred_writes()
         try:
             self.cursor.execute("""
                 INSERT INTO aban_usage_log 
                 (guild_id, admin_id, target_id, timestamp) 
                 VALUES (?, ?, ?, ?)
-            """, (guild_id, admin_id, target_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            """, (guild_id, admin_id, target_id, timestamp))
             self.connection.commit()
             return True
         except sqlite3.Error as e:
             print(f"[Ошибка БД] log_aban_usage: {e}")
             return False
 
-    def get_aban_history(self, guild_id, limit=10):
+    def flush_deferred_writes(self, force=False):
+        # После ошибки повторная попытка откладывается, чтобы не нагружать БД на каждом вызове
+        if not self._deferred_aban_usage:
+            return True
+        if not force and time.monotonic() < self._deferred_retry_at:
+            return False
+        try:
+            self.cursor.executemany(
+                "INSERT INTO aban_usage_log (guild_id, admin_id, target_id, timestamp) VALUES (?, ?, ?, ?)",
+                self._deferred_aban_usage
+            )
+            self.connection.commit()
+            self._deferred_aban_usage = []
+            self._deferred_failures = 0
+            self._deferred_retry_at = 0.0
+            return True
+        except sqlite3.Error as e:
+            self.connection.rollback()
+            self._deferred_failures += 1
+            delay = min(self.DEFERRED_RETRY * 2 ** (self._deferred_failures - 1), self.DEFERRED_RETRY_MAX)
+            self._deferred_retry_at = time.monotonic() + delay
+            self._trim_deferred_writes()
+            print(f"[Ошибка БД] flush_deferred_writes: {e} (повтор через {delay:.0f} с)")
+            return False
+
+    def _trim_deferred_writes(self):
+        # Буфер не растёт больше DEFERRED_LIMIT: самые старые записи отбрасываются
+        dropped = len(self._deferred_aban_usage) - self.DEFERRED_LIMIT
+        if dropped > 0:
+            del self._deferred_aban_usage[:dropped]
+            print(f"[Ошибка БД] Отброшено отложенных записей aban_usage_log: {dropped}")
+
+    def get_guild_load(self, n=10):
+        return self.profiler.top(n)
+
+    def get_aban_history(self, guild_id, limit=10, before=None):
+        rows = self.get_event_history("aban_usage_log", guild_id, limit, before)
+        return [{"admin_id": r["admin_id"], "target_id": r["target_id"], "timestamp": r["timestamp"]} for r in rows]
+
+    def archive_events(self, older_than_ms=None):
+        # Переносит события старше порога из журналов в сжатые чанки архива; возвращает число строк
+        cutoff = now_ms() - (older_than_ms if older_than_ms is not None else self.ARCHIVE_AFTER_MS)
+        archived = 0
+        self.flush_deferred_writes()
+        for table, columns in self.ARCHIVE_TABLES.items():
+            try:
+                self.cursor.execute(f"SELECT DISTINCT guild_id FROM {table} WHERE timestamp < ?", (cutoff,))
+                guild_ids = [row[0] for row in self.cursor.fetchall()]
+            except sqlite3.Error as e:
+                print(f"[Ошибка БД] archive_events ({table}): {e}")
+                continue
+            for guild_id in guild_ids:
+                archived += self._archive_guild_events(table, columns, guild_id, cutoff)
+        return archived
+
+    def _archive_guild_events(self, table, columns, guild_id, cutoff):
+        # Чанк пишется до удаления строк: после сбоя строки останутся в таблице,
+        # а при повторном запуске объединятся с чанком без дублей (по id)
+        ts_index = columns.index("timestamp")
         try:
             self.cursor.execute(
-                """
-                SELECT admin_id, target_id, timestamp 
-                FROM aban_usage_log 
-                WHERE guild_id = ? 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-                """,
-                (guild_id, limit)
+                f"SELECT {', '.join(columns)} FROM {table} WHERE guild_id = ? AND timestamp < ? ORDER BY timestamp, id",
+                (guild_id, cutoff)
             )
             rows = self.cursor.fetchall()
-            return [{"admin_id": r[0], "target_id": r[1], "timestamp": r[2]} for r in rows]
+            if not rows:
+                return 0
+            by_month = {}
+            for row in rows:
+                by_month.setdefault(month_of(row[ts_index]), []).append(row)
+            for month, month_rows in by_month.items():
+                path = chunk_path(self.archive_dir, table, guild_id, month)
+                if os.path.exists(path):
+                    new_ids = {row[0] for row in month_rows}
+                    _, existing = read_chunk(path)
+                    month_rows = [row for row in existing if row[0] not in new_ids] + month_rows
+                    month_rows.sort(key=lambda row: (row[ts_index], row[0]))
+                write_chunk(path, columns, month_rows)
+                self.cursor.execute(
+                    "INSERT OR REPLACE INTO archive_chunks "
+                    "(table_name, guild_id, month, row_count, min_ts, max_ts) VALUES (?, ?, ?, ?, ?, ?)",
+                    (table, guild_id, month, len(month_rows), month_rows[0][ts_index], month_rows[-1][ts_index])
+                )
+            self.cursor.execute(
+                f"DELETE FROM {table} WHERE guild_id = ? AND timestamp < ? AND id <= ?",
+                (guild_id, cutoff, max(row[0] for row in rows))
+            )
+            self.connection.commit()
+            return len(rows)
+        except (sqlite3.Error, OSError, ValueError) as e:
+            self.connection.rollback()
+            print(f"[Ошибка БД] Не удалось архивировать {table} сервера {guild_id}: {e}")
+            return 0
+
+    def get_event_history(self, table, guild_id, limit=10, before=None):
+        # Последние события сервера из живой таблицы и архива вместе, новые первыми.
+        # before — граница по времени (мс) для постраничного просмотра.
+        if limit <= 0:
+            return []
+        # Отложенные записи log_aban_usage должны попасть в выборку
+        self.flush_deferred_writes()
+        columns = self.ARCHIVE_TABLES[table]
+        ts_index = columns.index("timestamp")
+        before = before if before is not None else 1 << 62
+        try:
+            self.cursor.execute(
+                f"SELECT {', '.join(columns)} FROM {table} "
+                f"WHERE guild_id = ? AND timestamp < ? ORDER BY timestamp DESC, id DESC LIMIT ?",
+                (guild_id, before, limit)
+            )
+            rows = self.cursor.fetchall()
+            self.cursor.execute(
+                "SELECT month, max_ts FROM archive_chunks "
+                "WHERE guild_id = ? AND table_name = ? AND min_ts < ? ORDER BY month DESC",
+                (guild_id, table, before)
+            )
+            chunks = self.cursor.fetchall()
         except sqlite3.Error as e:
-            print(f"Ошибка получения истории использования /aban: {e}")
+            print(f"[Ошибка БД] get_event_history: {e}")
             return []
 
+        seen = {row[0] for row in rows}
+        for month, max_ts in chunks:
+            # Чанки идут от новых к старым: дальше искать нечего, когда набран limit более свежих строк
+            if len(rows) >= limit and max_ts < rows[limit - 1][ts_index]:
+                break
+            try:
+                _, archived = read_chunk(chunk_path(self.archive_dir, table, guild_id, month))
+            except (OSError, ValueError) as e:
+                print(f"[Ошибка БД] Не удалось прочитать архив {table} сервера {guild_id} за {month}: {e}")
+                continue
+            rows.extend(row for row in archived if row[ts_index] < before and row[0] not in seen)
+            rows.sort(key=lambda row: (row[ts_index], row[0]), reverse=True)
+            del rows[limit:]
+            seen = {row[0] for row in rows}
+        return [dict(zip(columns, row)) for row in rows]
+
     def get_protection_status(self, guild_id):
         try:
             self.cursor.execute("SELECT is_enabled FROM protection_status WHERE guild_id = ?", (guild_id,))
@@ -585,8 +1399,96 @@ class Database:
 
 
 
+    def purge_guild(self, guild_id, grace_ms=None):
+        # С grace_ms данные сохраняются до истечения срока на случай повторного приглашения бота
+        if grace_ms:
+            try:
+                self.cursor.execute(
+                    "INSERT OR REPLACE INTO guild_tombstones (guild_id, purge_after) VALUES (?, ?)",
+                    (guild_id, now_ms() + grace_ms)
+                )
+                self.connection.commit()
+                return 0
+            except sqlite3.Error as e:
+                print(f"[Ошибка БД] purge_guild: {e}")
+                return 0
+        return self.purge_guilds([guild_id])
+
+    def purge_guilds(self, guild_ids):
+        # Удаляет все данные серверов одной транзакцией и возвращает число удалённых строк
+        guild_ids = list(dict.fromkeys(guild_ids))
+        if not guild_ids:
+            return 0
+        deleted = 0
+        try:
+            for start in range(0, len(guild_ids), self.PURGE_CHUNK):
+                chunk = guild_ids[start:start + self.PURGE_CHUNK]
+                placeholders = ", ".join("?" * len(chunk))
+                # У snapshot_entries нет guild_id — удаляем через снимки, пока они ещё существуют
+                self.cursor.execute(
+                    f"DELETE FROM snapshot_entries WHERE snapshot_id IN "
+                    f"(SELECT id FROM guild_snapshots WHERE guild_id IN ({placeholders}))",
+                    chunk
+                )
+                deleted += self.cursor.rowcount
+                for table in self.GUILD_TABLES + ("guild_tombstones",):
+                    self.cursor.execute(f"DELETE FROM {table} WHERE guild_id IN ({placeholders})", chunk)
+                    deleted += self.cursor.rowcount
+            for table in self._cache_loaders:
+                for guild_id in guild_ids:
+                    self._record_change(table, guild_id)
+            self.connection.commit()
+        except sqlite3.Error as e:
+            self.connection.rollback()
+            print(f"[Ошибка БД] purge_guilds: {e}")
+            return 0
+        for reload in self._cache_loaders.values():
+            for guild_id in guild_ids:
+                reload(guild_id)
+        purged = set(guild_ids)
+        self._deferred_aban_usage = [row for row in self._deferred_aban_usage if row[0] not in purged]
+        for guild_id in guild_ids:
+            self.profiler.forget(guild_id)
+        for table in self.ARCHIVE_TABLES:
+            for guild_id in guild_ids:
+                shutil.rmtree(os.path.join(self.archive_dir, table, str(guild_id)), ignore_errors=True)
+        return deleted
+
+    def cancel_guild_purge(self, guild_id):
+        try:
+            self.cursor.execute("DELETE FROM guild_tombstones WHERE guild_id = ?", (guild_id,))
+            self.connection.commit()
+            return self.cursor.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"[Ошибка БД] cancel_guild_purge: {e}")
+            return False
+
+    def purge_expired_guilds(self, limit=10):
+        try:
+            self.cursor.execute(
+                "SELECT guild_id FROM guild_tombstones WHERE purge_after <= ? ORDER BY purge_after LIMIT ?",
+                (now_ms(), limit)
+            )
+            guild_ids = [row[0] for row in self.cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"[Ошибка БД] purge_expired_guilds: {e}")
+            return []
+        if guild_ids:
+            self.purge_guilds(guild_ids)
+        return guild_ids
+
+    async def purge_job(self, interval=300, batch_size=10, pause=1):
+        # Фоновая очистка: не больше batch_size серверов за транзакцию, между пачками — пауза,
+        # чтобы не занимать SQLite надолго. Запускается через bot.loop.create_task(db.purge_job())
+        while True:
+            purged = self.purge_expired_guilds(batch_size)
+            self.flush_deferred_writes()
+            await asyncio.sleep(pause if len(purged) == batch_size else interval)
+
     def close(self):
         if self.connection:
+            self.flush_deferred_writes(force=True)
+            self.save_snapshot()
             self.connection.close()
 
     def get_all_global_ban_servers(self):
@@ -610,6 +1512,7 @@ class Database:
                 self.gban_allowed_roles[guild_id] = set(role_ids)
             else:
                 self.gban_allowed_roles.pop(guild_id, None)
+            self._record_change("gban_allowed_roles", guild_id)
             self.connection.commit()
             return True
         except sqlite3.Error as e:
@@ -655,7 +1558,16 @@ class Database:
         pass
 
     def log_raid_attempt(self, guild_id):
-        pass
+        try:
+            self.cursor.execute(
+                "INSERT INTO raid_attempts (guild_id, timestamp) VALUES (?, ?)",
+                (guild_id, now_ms())
+            )
+            self.connection.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"[Ошибка БД] log_raid_attempt: {e}")
+            return False
 
     def log_role_block(self, guild_id):
         pass
@@ -719,8 +1631,8 @@ class Database:
             WHERE guild_id = ?
               AND user_id = ?
               AND action_type = ?
-              AND timestamp >= datetime('now', '-1 day')
-        """, (str(guild_id), str(user_id), action_type))
+              AND timestamp >= ?
+        """, (guild_id, user_id, action_type, now_ms() - 86400000))
 
         return self.cursor.fetchone()[0]
 
@@ -728,8 +1640,8 @@ class Database:
         try:
             self.cursor.execute('''
                 INSERT INTO action_logs (guild_id, user_id, action_type, timestamp)
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (str(guild_id), str(user_id), action_type))
+                VALUES (?, ?, ?, ?)
+            ''', (guild_id, user_id, action_type, now_ms()))
             self.connection.commit()
             return True
         except sqlite3.Error as e:
@@ -889,3 +1801,38 @@ class Database:
         except sqlite3.Error as e:
             print(f"[Ошибка БД] get_antiremove_users: {e}")
             return []
+
+
+def _profiled(method, position):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        # Вложенные вызовы (например, get_aban_history -> get_event_history) учитываются во внешнем
+        if self._profile_depth:
+            return method(self, *args, **kwargs)
+        guild_id = kwargs["guild_id"] if "guild_id" in kwargs else args[position] if len(args) > position else None
+        changes = self.connection.total_changes
+        started = time.perf_counter()
+        self._profile_depth += 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._profile_depth -= 1
+            self.profiler.record(guild_id, time.perf_counter() - started, self.connection.total_changes - changes)
+    return wrapper
+
+
+# purge_guild удаляет сервер из профилировщика — обёртка не должна вносить его обратно
+_UNPROFILED_METHODS = ("purge_guild",)
+
+
+def _instrument_guild_methods(cls):
+    # Оборачивает все публичные методы с аргументом guild_id для учёта нагрузки по серверам
+    for name, member in list(vars(cls).items()):
+        if name.startswith("_") or name in _UNPROFILED_METHODS or not inspect.isfunction(member) or inspect.iscoroutinefunction(member):
+            continue
+        parameters = list(inspect.signature(member).parameters)
+        if "guild_id" in parameters:
+            setattr(cls, name, _profiled(member, parameters.index("guild_id") - 1))
+
+
+_instrument_guild_methods(Database)
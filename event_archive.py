@@ -0,0 +1,123 @@
+import json
+import os
+import struct
+import zlib
+from array import array
+from datetime import datetime, timezone
+
+# Формат чанка: сигнатура, версия, затем сжатые zlib метаданные и столбцы, записанные подряд
+CHUNK_MAGIC = b"ARBA"
+CHUNK_VERSION = 1
+CHUNK_HEADER = struct.Struct("<4sB")
+
+
+def month_of(timestamp_ms):
+    return datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc).strftime("%Y-%m")
+
+
+def chunk_path(archive_dir, table, guild_id, month):
+    return os.path.join(archive_dir, table, str(guild_id), f"{month}.arc")
+
+
+def _encode_column(values):
+    # int  — все значения целые: дельты от предыдущего значения (id и время растут почти монотонно)
+    # dict — строки: словарь уникальных значений и коды, None кодируется как -1
+    # json — всё остальное (например, целые вперемешку с NULL)
+    if all(type(value) is int for value in values):
+        deltas = array("q", (value - prev for prev, value in zip([0] + values[:-1], values)))
+        return {"kind": "int"}, deltas.tobytes()
+    if all(value is None or isinstance(value, str) for value in values):
+        dictionary = sorted({value for value in values if value is not None})
+        codes = {value: i for i, value in enumerate(dictionary)}
+        encoded = array("i", (codes[value] if value is not None else -1 for value in values))
+        return {"kind": "dict", "values": dictionary}, encoded.tobytes()
+    return {"kind": "json"}, json.dumps(values, separators=(",", ":")).encode()
+
+
+def _decode_column(meta, data):
+    if meta["kind"] == "int":
+        deltas = array("q")
+        deltas.frombytes(data)
+        values, current = [], 0
+        for delta in deltas:
+            current += delta
+            values.append(current)
+        return values
+    if meta["kind"] == "dict":
+        codes = array("i")
+        codes.frombytes(data)
+        dictionary = meta["values"]
+        return [dictionary[code] if code >= 0 else None for code in codes]
+    return json.loads(data)
+
+
+def encode_chunk(columns, rows):
+    # rows — список кортежей в порядке columns; возвращает готовое содержимое файла
+    blocks, metas = [], []
+    for i, name in enumerate(columns):
+        meta, data = _encode_column([row[i] for row in rows])
+        meta["name"] = name
+        meta["size"] = len(data)
+        metas.append(meta)
+        blocks.append(data)
+    meta = json.dumps({"rows": len(rows), "columns": metas}, separators=(",", ":")).encode()
+    body = struct.pack("<I", len(meta)) + meta + b"".join(blocks)
+    return CHUNK_HEADER.pack(CHUNK_MAGIC, CHUNK_VERSION) + zlib.compress(body, 9)
+
+
+def decode_chunk(data):
+    # Возвращает (имена столбцов, список строк-кортежей)
+    magic, version = CHUNK_HEADER.unpack_from(data, 0)
+    if magic != CHUNK_MAGIC or version != CHUNK_VERSION:
+        raise ValueError("неизвестный формат чанка архива")
+    body = zlib.decompress(data[CHUNK_HEADER.size:])
+    (meta_size,) = struct.unpack_from("<I", body, 0)
+    meta = json.loads(body[4:4 + meta_size])
+    offset = 4 + meta_size
+    names, values = [], []
+    for column in meta["columns"]:
+        names.append(column["name"])
+        values.append(_decode_column(column, body[offset:offset + column["size"]]))
+        offset += column["size"]
+    return names, list(zip(*values)) if values else []
+
+
+def read_chunk(path):
+    with open(path, "rb") as f:
+        return decode_chunk(f.read())
+
+
+def _fsync_dir(path):
+    # Фиксирует на диске записи каталога (новые файлы, переименования); в Windows каталог открыть нельзя
+    if os.name == "nt":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _makedirs_durable(directory):
+    # Как os.makedirs, но каждый созданный каталог фиксируется в родительском
+    missing = []
+    while directory and not os.path.isdir(directory):
+        missing.append(directory)
+        directory = os.path.dirname(directory)
+    for created in reversed(missing):
+        os.makedirs(created, exist_ok=True)
+        _fsync_dir(os.path.dirname(created) or ".")
+
+
+def write_chunk(path, columns, rows):
+    # Запись через временный файл: читатель никогда не увидит наполовину записанный чанк.
+    # После возврата чанк уже на диске — вызывающий код может удалять исходные строки из БД.
+    directory = os.path.dirname(path)
+    _makedirs_durable(directory)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(encode_chunk(columns, rows))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(directory)
@@ -0,0 +1,82 @@
+import time
+
+
+class GuildLoadProfiler:
+    # Учёт нагрузки на БД по серверам алгоритмом Space-Saving: хранится не больше capacity серверов,
+    # самые "тяжёлые" из них гарантированно остаются в таблице. Вес — время, проведённое в методах БД.
+    # Раз в decay_interval секунд все счётчики умножаются на decay, чтобы учитывалась недавняя нагрузка.
+    def __init__(self, capacity=32, decay_interval=60.0, decay=0.5):
+        self.capacity = capacity
+        self.decay_interval = decay_interval
+        self.decay = decay
+        # guild_id -> [вес, погрешность, вызовы, записанные строки]
+        self.entries = {}
+        self.total_weight = 0.0
+        self._last_decay = time.monotonic()
+
+    def _apply_decay(self, now):
+        periods = int((now - self._last_decay) // self.decay_interval)
+        if periods <= 0:
+            return
+        factor = self.decay ** periods
+        for entry in self.entries.values():
+            entry[0] *= factor
+            entry[1] *= factor
+            entry[2] *= factor
+            entry[3] *= factor
+        self.total_weight *= factor
+        self._last_decay += periods * self.decay_interval
+
+    def record(self, guild_id, seconds, rows=0):
+        self._apply_decay(time.monotonic())
+        entry = self.entries.get(guild_id)
+        if entry is None:
+            if len(self.entries) < self.capacity:
+                entry = [0.0, 0.0, 0.0, 0.0]
+            else:
+                # Вытесняем самый лёгкий сервер; новый наследует его вес как верхнюю оценку погрешности
+                victim = min(self.entries, key=lambda g: self.entries[g][0])
+                floor = self.entries.pop(victim)[0]
+                entry = [floor, floor, 0.0, 0.0]
+            self.entries[guild_id] = entry
+        entry[0] += seconds
+        entry[2] += 1
+        entry[3] += rows
+        self.total_weight += seconds
+
+    def top(self, n=10):
+        self._apply_decay(time.monotonic())
+        ranked = sorted(self.entries.items(), key=lambda item: item[1][0], reverse=True)[:n]
+        return [
+            {
+                "guild_id": guild_id,
+                "time_ms": weight * 1000,
+                "error_ms": error * 1000,
+                "calls": round(calls),
+                "rows_written": round(rows),
+                "share": weight / self.total_weight if self.total_weight else 0.0,
+            }
+            for guild_id, (weight, error, calls, rows) in ranked
+        ]
+
+    def share(self, guild_id):
+        # Доля сервера в общем времени; гарантированная (без погрешности) нижняя оценка
+        entry = self.entries.get(guild_id)
+        if entry is None or not self.total_weight:
+            return 0.0
+        return (entry[0] - entry[1]) / self.total_weight
+
+    def is_heavy(self, guild_id, min_share=0.25, min_time=1.0):
+        # Сервер считается шумным, если занимает заметную долю при существенной общей нагрузке
+        return self.total_weight >= min_time and self.share(guild_id) >= min_share
+
+    def forget(self, guild_id):
+        # Сервер удалён: его вес больше не учитывается ни в таблице, ни в общей нагрузке
+        entry = self.entries.pop(guild_id, None)
+        if entry is not None:
+            self.total_weight = max(self.total_weight - entry[0], 0.0)
+
+    def reset(self):
+        self.entries.clear()
+        self.total_weight = 0.0
+        self._last_decay = time.monotonic()
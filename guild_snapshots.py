@@ -0,0 +1,375 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+
+from database import now_ms
+
+ROLE_FIELDS = ("name", "permissions", "color", "hoist", "mentionable", "position")
+CHANNEL_FIELDS = ("name", "type", "position", "parent_id", "topic", "nsfw", "slowmode_delay", "overwrites")
+# Каждый N-й снимок сохраняется целиком, чтобы цепочка диффов при загрузке оставалась короткой
+KEYFRAME_INTERVAL = 20
+# Сколько последних снимков сервера оставляет prune_snapshots() по умолчанию
+KEEP_SNAPSHOTS = 50
+RESTORE_REASON = "Anti Raid Bot • Восстановление после рейда"
+
+
+def serialize_guild(guild):
+    # Структура сервера discord.py в виде словаря "role:<id>" / "channel:<id>" -> данные объекта
+    state = {}
+    for role in guild.roles:
+        state[f"role:{role.id}"] = {
+            "id": role.id,
+            "name": role.name,
+            "permissions": role.permissions.value,
+            "color": role.color.value,
+            "hoist": role.hoist,
+            "mentionable": role.mentionable,
+            "position": role.position,
+            "managed": role.managed,
+            "default": role.is_default(),
+        }
+    for channel in guild.channels:
+        overwrites = []
+        for target, overwrite in channel.overwrites.items():
+            allow, deny = overwrite.pair()
+            overwrites.append({
+                # У роли есть hoist, у участника — нет
+                "type": "role" if hasattr(target, "hoist") else "member",
+                "id": target.id,
+                "allow": allow.value,
+                "deny": deny.value,
+            })
+        state[f"channel:{channel.id}"] = {
+            "id": channel.id,
+            "name": channel.name,
+            "type": str(channel.type),
+            "position": channel.position,
+            "parent_id": channel.category_id,
+            "topic": getattr(channel, "topic", None),
+            "nsfw": getattr(channel, "nsfw", False),
+            "slowmode_delay": getattr(channel, "slowmode_delay", 0),
+            "overwrites": sorted(overwrites, key=lambda o: (o["type"], o["id"])),
+        }
+    return state
+
+
+def object_hash(obj):
+    data = json.dumps(obj, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class SnapshotStore:
+    def __init__(self, db, keyframe_interval=KEYFRAME_INTERVAL):
+        self.db = db
+        self.cursor = db.connection.cursor()
+        self.keyframe_interval = keyframe_interval
+
+    def _chain_hashes(self, snapshot_id):
+        # Собирает состояние снимка (ключ -> хеш), применяя диффы от полного снимка к нужному
+        self.cursor.execute('''
+            WITH RECURSIVE chain (id, parent_id, depth) AS (
+                SELECT id, parent_id, 0 FROM guild_snapshots WHERE id = ?
+                UNION ALL
+                SELECT s.id, s.parent_id, c.depth + 1
+                FROM guild_snapshots s JOIN chain c ON s.id = c.parent_id
+            )
+            SELECT c.depth, e.object_key, e.hash
+            FROM chain c JOIN snapshot_entries e ON e.snapshot_id = c.id
+            ORDER BY c.depth DESC
+        ''', (snapshot_id,))
+        hashes = {}
+        depth = 0
+        for level, key, value in self.cursor.fetchall():
+            depth = max(depth, level)
+            if value is None:
+                hashes.pop(key, None)
+            else:
+                hashes[key] = value
+        return hashes, depth + 1
+
+    def _latest_snapshot(self, guild_id):
+        self.cursor.execute(
+            "SELECT id FROM guild_snapshots WHERE guild_id = ? ORDER BY id DESC LIMIT 1",
+            (guild_id,)
+        )
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    def take_snapshot(self, guild_id, state):
+        # Сохраняет только изменившиеся объекты; если ничего не изменилось, возвращает id последнего снимка
+        try:
+            hashes = {key: object_hash(obj) for key, obj in state.items()}
+            parent_id = self._latest_snapshot(guild_id)
+            parent_hashes, chain_length = self._chain_hashes(parent_id) if parent_id else ({}, 0)
+            if parent_id and chain_length < self.keyframe_interval:
+                entries = {key: value for key, value in hashes.items() if parent_hashes.get(key) != value}
+                entries.update({key: None for key in parent_hashes if key not in hashes})
+                if not entries:
+                    return parent_id
+            else:
+                parent_id = None
+                entries = hashes
+
+            known = set(parent_hashes.values())
+            self.cursor.executemany(
+                "INSERT OR IGNORE INTO snapshot_objects (guild_id, hash, data) VALUES (?, ?, ?)",
+                [
+                    (guild_id, hashes[key], json.dumps(obj, sort_keys=True, separators=(",", ":")))
+                    for key, obj in state.items() if hashes[key] not in known
+                ]
+            )
+            self.cursor.execute(
+                "INSERT INTO guild_snapshots (guild_id, parent_id, created_at) VALUES (?, ?, ?)",
+                (guild_id, parent_id, now_ms())
+            )
+            snapshot_id = self.cursor.lastrowid
+            self.cursor.executemany(
+                "INSERT INTO snapshot_entries (snapshot_id, object_key, hash) VALUES (?, ?, ?)",
+                [(snapshot_id, key, value) for key, value in entries.items()]
+            )
+            self.db.connection.commit()
+            return snapshot_id
+        except sqlite3.Error as e:
+            self.db.connection.rollback()
+            print(f"[Ошибка БД] Не удалось сохранить снимок сервера {guild_id}: {e}")
+            return None
+
+    def load_snapshot(self, guild_id, snapshot_id):
+        try:
+            self.cursor.execute("SELECT guild_id FROM guild_snapshots WHERE id = ?", (snapshot_id,))
+            row = self.cursor.fetchone()
+            if row is None or row[0] != guild_id:
+                return None
+            hashes, _ = self._chain_hashes(snapshot_id)
+            unique = list(set(hashes.values()))
+            objects = {}
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                self.cursor.execute(
+                    f"SELECT hash, data FROM snapshot_objects WHERE guild_id = ? AND hash IN ({', '.join('?' * len(chunk))})",
+                    [guild_id] + chunk
+                )
+                objects.update((value, json.loads(data)) for value, data in self.cursor.fetchall())
+            return {key: objects[value] for key, value in hashes.items()}
+        except sqlite3.Error as e:
+            print(f"[Ошибка БД] Не удалось загрузить снимок {snapshot_id}: {e}")
+            return None
+
+    def prune_snapshots(self, guild_id, keep=KEEP_SNAPSHOTS):
+        # Оставляет keep последних снимков: старейший из них становится полным снимком,
+        # более старые снимки и объекты, на которые больше никто не ссылается, удаляются.
+        # Возвращает число удалённых снимков.
+        try:
+            self.cursor.execute(
+                "SELECT id, parent_id FROM guild_snapshots WHERE guild_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+                (guild_id, max(keep, 1) - 1)
+            )
+            row = self.cursor.fetchone()
+            if row is None:
+                return 0
+            cut_id, cut_parent = row
+            if cut_parent is not None:
+                hashes, _ = self._chain_hashes(cut_id)
+                self.cursor.execute("DELETE FROM snapshot_entries WHERE snapshot_id = ?", (cut_id,))
+                self.cursor.executemany(
+                    "INSERT INTO snapshot_entries (snapshot_id, object_key, hash) VALUES (?, ?, ?)",
+                    [(cut_id, key, value) for key, value in hashes.items()]
+                )
+                self.cursor.execute("UPDATE guild_snapshots SET parent_id = NULL WHERE id = ?", (cut_id,))
+            self.cursor.execute(
+                "DELETE FROM snapshot_entries WHERE snapshot_id IN "
+                "(SELECT id FROM guild_snapshots WHERE guild_id = ? AND id < ?)",
+                (guild_id, cut_id)
+            )
+            self.cursor.execute("DELETE FROM guild_snapshots WHERE guild_id = ? AND id < ?", (guild_id, cut_id))
+            deleted = self.cursor.rowcount
+            self.cursor.execute('''
+                DELETE FROM snapshot_objects WHERE guild_id = ? AND hash NOT IN (
+                    SELECT e.hash FROM snapshot_entries e JOIN guild_snapshots s ON s.id = e.snapshot_id
+                    WHERE s.guild_id = ? AND e.hash IS NOT NULL
+                )
+            ''', (guild_id, guild_id))
+            self.db.connection.commit()
+            return deleted
+        except sqlite3.Error as e:
+            self.db.connection.rollback()
+            print(f"[Ошибка БД] Не удалось удалить старые снимки сервера {guild_id}: {e}")
+            return 0
+
+    def list_snapshots(self, guild_id, limit=20):
+        try:
+            self.cursor.execute(
+                "SELECT id, parent_id, created_at FROM guild_snapshots WHERE guild_id = ? ORDER BY id DESC LIMIT ?",
+                (guild_id, limit)
+            )
+            return [{"id": r[0], "parent_id": r[1], "created_at": r[2]} for r in self.cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"[Ошибка БД] list_snapshots: {e}")
+            return []
+
+    def diff_snapshots(self, from_id, to_id):
+        try:
+            before, _ = self._chain_hashes(from_id)
+            after, _ = self._chain_hashes(to_id)
+        except sqlite3.Error as e:
+            print(f"[Ошибка БД] diff_snapshots: {e}")
+            return None
+        return {
+            "added": sorted(key for key in after if key not in before),
+            "changed": sorted(key for key in after if key in before and before[key] != after[key]),
+            "removed": sorted(key for key in before if key not in after),
+        }
+
+
+def plan_restore(target, current):
+    # Минимальный набор операций create/edit, возвращающий сервер к состоянию target.
+    # Фазы: 0 — создание ролей, 1 — создание категорий, 2 — остальные каналы и правки
+    # (им нужны id ролей и категорий, созданных в предыдущих фазах).
+    plan = []
+    for key, obj in target.items():
+        kind = key.split(":", 1)[0]
+        fields = ROLE_FIELDS if kind == "role" else CHANNEL_FIELDS
+        live = current.get(key)
+        if kind == "role" and obj.get("managed"):
+            continue
+        if live is None:
+            if obj.get("default"):
+                continue
+            if kind == "role":
+                phase = 0
+            else:
+                phase = 1 if obj["type"] == "category" else 2
+            plan.append({
+                "action": f"create_{kind}",
+                "phase": phase,
+                "id": obj["id"],
+                "data": {field: obj.get(field) for field in fields},
+            })
+        else:
+            changes = {field: obj.get(field) for field in fields if field != "type" and obj.get(field) != live.get(field)}
+            if changes:
+                plan.append({"action": f"edit_{kind}", "phase": 2, "id": obj["id"], "data": changes})
+    return plan
+
+
+def _resolve_ids(data, id_map):
+    # Подставляет новые id вместо id ролей и категорий, пересозданных во время восстановления
+    data = dict(data)
+    if data.get("parent_id") is not None:
+        data["parent_id"] = id_map.get(data["parent_id"], data["parent_id"])
+    if "overwrites" in data:
+        data["overwrites"] = [
+            dict(overwrite, id=id_map.get(overwrite["id"], overwrite["id"])) for overwrite in data["overwrites"] or []
+        ]
+    return data
+
+
+async def execute_plan(plan, client, guild_id, concurrency=5):
+    # Операции одной фазы выполняются параллельно (не больше concurrency одновременно).
+    # client — объект с корутинами create_role, edit_role, create_channel, edit_channel
+    # (см. DiscordRestoreClient); в тестах его легко заменить заглушкой.
+    id_map = {}
+    failed = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(op):
+        async with semaphore:
+            data = _resolve_ids(op["data"], id_map)
+            target_id = id_map.get(op["id"], op["id"])
+            if op["action"] == "create_role":
+                id_map[op["id"]] = await client.create_role(guild_id, data)
+            elif op["action"] == "create_channel":
+                id_map[op["id"]] = await client.create_channel(guild_id, data)
+            elif op["action"] == "edit_role":
+                await client.edit_role(guild_id, target_id, data)
+            elif op["action"] == "edit_channel":
+                await client.edit_channel(guild_id, target_id, data)
+
+    for phase in sorted({op["phase"] for op in plan}):
+        ops = [op for op in plan if op["phase"] == phase]
+        results = await asyncio.gather(*(run(op) for op in ops), return_exceptions=True)
+        failed.extend((op, result) for op, result in zip(ops, results) if isinstance(result, Exception))
+    return {"id_map": id_map, "failed": failed}
+
+
+class DiscordRestoreClient:
+    # Выполняет операции плана через discord.py.
+    # Созданные роли и категории попадают в кеш гильдии только с событием шлюза, поэтому
+    # get_role()/get_channel() сразу после создания возвращают None. Цели перезаписей и
+    # категории строятся из данных плана, а созданные объекты запоминаются в self.created.
+    def __init__(self, bot):
+        self.bot = bot
+        self.created = {}
+
+    def _guild(self, guild_id):
+        return self.bot.get_guild(guild_id)
+
+    def _overwrites(self, overwrites):
+        import discord
+        result = {}
+        for overwrite in overwrites or []:
+            target_type = discord.Role if overwrite["type"] == "role" else discord.Member
+            target = discord.Object(id=overwrite["id"], type=target_type)
+            result[target] = discord.PermissionOverwrite.from_pair(
+                discord.Permissions(overwrite["allow"]), discord.Permissions(overwrite["deny"])
+            )
+        return result
+
+    def _get(self, guild, object_id, getter):
+        return self.created.get(object_id) or getattr(guild, getter)(object_id)
+
+    @staticmethod
+    def _role_options(data):
+        import discord
+        options = {key: data[key] for key in ("name", "hoist", "mentionable") if key in data}
+        if "permissions" in data:
+            options["permissions"] = discord.Permissions(data["permissions"])
+        if "color" in data:
+            options["colour"] = discord.Colour(data["color"])
+        return options
+
+    def _channel_options(self, data):
+        import discord
+        options = {key: data[key] for key in ("name", "position", "topic", "nsfw", "slowmode_delay") if key in data}
+        if "overwrites" in data:
+            options["overwrites"] = self._overwrites(data["overwrites"])
+        if "parent_id" in data:
+            parent_id = data["parent_id"]
+            options["category"] = (self.created.get(parent_id) or discord.Object(id=parent_id)) if parent_id else None
+        return options
+
+    async def create_role(self, guild_id, data):
+        guild = self._guild(guild_id)
+        role = await guild.create_role(reason=RESTORE_REASON, **self._role_options(data))
+        self.created[role.id] = role
+        if data.get("position"):
+            await role.edit(position=data["position"], reason=RESTORE_REASON)
+        return role.id
+
+    async def edit_role(self, guild_id, role_id, changes):
+        guild = self._guild(guild_id)
+        options = self._role_options(changes)
+        if "position" in changes:
+            options["position"] = changes["position"]
+        await self._get(guild, role_id, "get_role").edit(reason=RESTORE_REASON, **options)
+
+    async def create_channel(self, guild_id, data):
+        guild = self._guild(guild_id)
+        options = {key: value for key, value in self._channel_options(data).items() if value is not None}
+        name = options.pop("name")
+        if data["type"] == "category":
+            options = {key: options[key] for key in ("position", "overwrites") if key in options}
+            channel = await guild.create_category(name, reason=RESTORE_REASON, **options)
+        elif data["type"] in ("voice", "stage_voice"):
+            options = {key: options[key] for key in ("position", "overwrites", "category") if key in options}
+            channel = await guild.create_voice_channel(name, reason=RESTORE_REASON, **options)
+        else:
+            channel = await guild.create_text_channel(name, reason=RESTORE_REASON, **options)
+        self.created[channel.id] = channel
+        return channel.id
+
+    async def edit_channel(self, guild_id, channel_id, changes):
+        guild = self._guild(guild_id)
+        channel = self._get(guild, channel_id, "get_channel")
+        await channel.edit(reason=RESTORE_REASON, **self._channel_options(changes))
@@ -0,0 +1,172 @@
+import time
+
+# Границы гистограммы возраста аккаунтов (в секундах): <1ч, <1д, <7д, <30д, старше
+AGE_BUCKETS = (3600, 86400, 7 * 86400, 30 * 86400)
+
+
+class WindowCounter:
+    # Скользящее окно из фиксированного числа корзин: добавление и чтение суммы за O(1)
+    def __init__(self, window, buckets=10):
+        self.bucket_size = window / buckets
+        self.counts = [0] * buckets
+        self.total = 0
+        self._bucket = None
+
+    def _advance(self, now):
+        bucket = int(now // self.bucket_size)
+        if self._bucket is None or bucket - self._bucket >= len(self.counts):
+            self.counts = [0] * len(self.counts)
+            self.total = 0
+        elif bucket > self._bucket:
+            for b in range(self._bucket + 1, bucket + 1):
+                i = b % len(self.counts)
+                self.total -= self.counts[i]
+                self.counts[i] = 0
+        else:
+            # События из прошлого (неупорядоченный трейс) учитываем в текущей корзине
+            return
+        self._bucket = bucket
+
+    def add(self, now, amount=1):
+        self._advance(now)
+        self.counts[self._bucket % len(self.counts)] += amount
+        self.total += amount
+
+    def value(self, now):
+        self._advance(now)
+        return self.total
+
+
+class GuildStats:
+    def __init__(self, join_window, action_window):
+        self.joins = WindowCounter(join_window)
+        self.ages = [WindowCounter(join_window) for _ in range(len(AGE_BUCKETS) + 1)]
+        self.actions = WindowCounter(action_window)
+        self.last_event = 0
+        self.triggered_at = None
+
+    def age_distribution(self, now):
+        return [counter.value(now) for counter in self.ages]
+
+
+class RaidDetector:
+    def __init__(
+        self,
+        db,
+        join_window=60,
+        join_threshold=15,
+        young_account_age=7 * 86400,
+        young_ratio=0.6,
+        young_min_joins=5,
+        action_window=10,
+        action_threshold=10,
+        cooldown=300,
+    ):
+        self.db = db
+        self.join_window = join_window
+        self.join_threshold = join_threshold
+        self.young_account_age = young_account_age
+        self.young_ratio = young_ratio
+        self.young_min_joins = young_min_joins
+        self.action_window = action_window
+        self.action_threshold = action_threshold
+        self.cooldown = cooldown
+        self.guilds = {}
+        # Корзины гистограммы, целиком попадающие в "молодые" аккаунты
+        self._young_buckets = sum(1 for bound in AGE_BUCKETS if bound <= young_account_age)
+
+    def _stats(self, guild_id, now):
+        stats = self.guilds.get(guild_id)
+        if stats is None:
+            stats = self.guilds[guild_id] = GuildStats(self.join_window, self.action_window)
+        stats.last_event = now
+        return stats
+
+    def on_member_join(self, guild_id, account_created_at, now=None):
+        now = time.time() if now is None else now
+        if hasattr(account_created_at, "timestamp"):
+            account_created_at = account_created_at.timestamp()
+        stats = self._stats(guild_id, now)
+        stats.joins.add(now)
+
+        age = now - account_created_at
+        bucket = len(AGE_BUCKETS)
+        for i, bound in enumerate(AGE_BUCKETS):
+            if age < bound:
+                bucket = i
+                break
+        stats.ages[bucket].add(now)
+
+        joins = stats.joins.value(now)
+        if joins >= self.join_threshold:
+            return self._trigger(guild_id, stats, "join_wave", now)
+        if joins >= self.young_min_joins:
+            young = sum(counter.value(now) for counter in stats.ages[:self._young_buckets])
+            if young / joins >= self.young_ratio:
+                return self._trigger(guild_id, stats, "young_accounts", now)
+        return None
+
+    def on_action(self, guild_id, now=None):
+        # Создание/удаление ролей и каналов любыми участниками сервера
+        now = time.time() if now is None else now
+        stats = self._stats(guild_id, now)
+        stats.actions.add(now)
+        if stats.actions.value(now) >= self.action_threshold:
+            return self._trigger(guild_id, stats, "action_burst", now)
+        return None
+
+    def on_role_event(self, guild_id, now=None):
+        return self.on_action(guild_id, now)
+
+    def on_channel_event(self, guild_id, now=None):
+        return self.on_action(guild_id, now)
+
+    def _trigger(self, guild_id, stats, reason, now):
+        if stats.triggered_at is not None and now - stats.triggered_at < self.cooldown:
+            return None
+        stats.triggered_at = now
+        try:
+            self.db.log_raid_attempt(guild_id)
+            if self.db.get_protection_status(guild_id):
+                self.db.set_freeze_mode(guild_id, True)
+        except Exception as e:
+            print(f"[Ошибка] Не удалось обработать рейд на сервере {guild_id}: {e}")
+        return reason
+
+    def get_stats(self, guild_id, now=None):
+        now = time.time() if now is None else now
+        stats = self.guilds.get(guild_id)
+        if stats is None:
+            return None
+        return {
+            "joins": stats.joins.value(now),
+            "age_distribution": stats.age_distribution(now),
+            "actions": stats.actions.value(now),
+            "triggered_at": stats.triggered_at,
+        }
+
+    def prune(self, now=None):
+        # Удаляет состояние серверов без событий дольше окон и кулдауна
+        now = time.time() if now is None else now
+        idle = max(self.join_window, self.action_window, self.cooldown)
+        for guild_id in [g for g, s in self.guilds.items() if now - s.last_event > idle]:
+            del self.guilds[guild_id]
+
+    def feed(self, event):
+        kind = event["type"]
+        if kind == "join":
+            return self.on_member_join(event["guild_id"], event["account_created_at"], event["time"])
+        if kind == "role":
+            return self.on_role_event(event["guild_id"], event["time"])
+        if kind == "channel":
+            return self.on_channel_event(event["guild_id"], event["time"])
+        return None
+
+    def replay(self, events):
+        # Прогон записанного трейса: возвращает список (время, guild_id, причина) сработавших триггеров
+        triggers = []
+        for event in events:
+            reason = self.feed(event)
+            if reason:
+                triggers.append((event["time"], event["guild_id"], reason))
+        return triggers
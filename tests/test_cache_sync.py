@@ -0,0 +1,18 @@
+from database import Database
+
+
+def test_caches_follow_other_connections(db):
+    other = Database(db.db_path)
+    try:
+        assert 10 not in db.global_ban_servers
+        other.add_global_ban_server(10, 1)
+        other.add_gban_allowed_role(10, 500)
+        assert 10 in db.global_ban_servers
+        assert db.gban_allowed_roles[10] == {500}
+
+        other.remove_global_ban_server(10)
+        other.remove_gban_allowed_role(10, 500)
+        assert 10 not in db.global_ban_servers
+        assert db.get_gban_allowed_roles(10) == []
+    finally:
+        other.close()
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+import event_archive
+from event_archive import read_chunk, write_chunk
+
+COLUMNS = ("id", "guild_id", "admin_id", "target_id", "timestamp")
+ROWS = [(1, 10, 100, 200, 1_700_000_000_000), (2, 10, 101, None, 1_700_000_005_000)]
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="нужен /proc для имён дескрипторов")
+def test_write_chunk_is_durable_before_return(tmp_path, monkeypatch):
+    events = []
+    real_fsync, real_replace = os.fsync, os.replace
+
+    def fsync(fd):
+        events.append(("fsync", os.readlink(f"/proc/self/fd/{fd}")))
+        real_fsync(fd)
+
+    def replace(src, dst):
+        events.append(("replace", dst))
+        real_replace(src, dst)
+
+    monkeypatch.setattr(event_archive.os, "fsync", fsync)
+    monkeypatch.setattr(event_archive.os, "replace", replace)
+    path = str(tmp_path / "aban_usage_log" / "10" / "2023-11.arc")
+    write_chunk(path, COLUMNS, ROWS)
+
+    assert read_chunk(path) == (list(COLUMNS), ROWS)
+    assert not os.path.exists(f"{path}.tmp")
+    # Данные чанка сбрасываются до переименования, каталог — после; новые каталоги фиксируются в родителях
+    assert events.index(("fsync", f"{path}.tmp")) < events.index(("replace", path))
+    assert events[-1] == ("fsync", os.path.dirname(path))
+    synced = {name for kind, name in events if kind == "fsync"}
+    assert {str(tmp_path), str(tmp_path / "aban_usage_log")} <= synced
+
+    events.clear()
+    write_chunk(path, COLUMNS, ROWS[:1])
+    assert events == [("fsync", f"{path}.tmp"), ("replace", path), ("fsync", os.path.dirname(path))]
+
+
+def test_history_merges_live_rows_and_archive(db):
+    old = 1_600_000_000_000
+    db.cursor.executemany(
+        "INSERT INTO aban_usage_log (guild_id, admin_id, target_id, timestamp) VALUES (?, ?, ?, ?)",
+        [(1, 100, target_id, old + target_id * 1000) for target_id in range(5)]
+    )
+    db.connection.commit()
+    assert db.archive_events() == 5
+    db.log_aban_usage(1, 100, 99)
+
+    history = db.get_aban_history(1, limit=3)
+    assert [entry["target_id"] for entry in history] == [99, 4, 3]
+    assert db.get_aban_history(1, limit=0) == []
+    assert [entry["target_id"] for entry in db.get_aban_history(1, limit=10, before=old + 2000)] == [1, 0]
@@ -0,0 +1,79 @@
+from guild_profiler import GuildLoadProfiler
+
+
+def _make_heavy(db, guild_id):
+    db.profiler.record(guild_id, 10.0)
+    assert db.profiler.is_heavy(guild_id)
+
+
+def test_forget_keeps_total_consistent():
+    profiler = GuildLoadProfiler()
+    profiler.record(1, 3.0)
+    profiler.record(2, 1.0)
+    profiler.forget(1)
+    profiler.forget(3)
+    assert [entry["guild_id"] for entry in profiler.top()] == [2]
+    assert profiler.total_weight == 1.0
+    assert profiler.share(2) == 1.0
+
+
+def test_failed_flush_backs_off_and_caps_buffer(db, monkeypatch):
+    monkeypatch.setattr(db, "DEFERRED_LIMIT", 5)
+    _make_heavy(db, 1)
+    db.cursor.execute("ALTER TABLE aban_usage_log RENAME TO aban_usage_log_off")
+    db.connection.commit()
+
+    for target_id in range(20):
+        assert db.log_aban_usage(1, 100, target_id)
+    assert [row[2] for row in db._deferred_aban_usage] == [15, 16, 17, 18, 19]
+    assert db._deferred_failures == 1
+
+    # Во время паузы запись не пытается выполниться, даже если БД уже доступна
+    db.cursor.execute("ALTER TABLE aban_usage_log_off RENAME TO aban_usage_log")
+    db.connection.commit()
+    assert not db.flush_deferred_writes()
+    assert len(db._deferred_aban_usage) == 5
+
+    assert db.flush_deferred_writes(force=True)
+    assert db._deferred_aban_usage == [] and db._deferred_failures == 0
+    db.cursor.execute("SELECT target_id FROM aban_usage_log WHERE guild_id = 1 ORDER BY target_id")
+    assert [row[0] for row in db.cursor.fetchall()] == [15, 16, 17, 18, 19]
+
+
+def test_purge_evicts_guild_from_profiler(db):
+    _make_heavy(db, 1)
+    db.log_aban_usage(1, 100, 200)
+    db.get_protection_status(2)
+    db.purge_guild(1)
+    assert 1 not in db.profiler.entries
+    assert 2 in db.profiler.entries
+    assert db._deferred_aban_usage == []
+
+
+def _logged_targets(db, guild_id):
+    db.cursor.execute("SELECT target_id FROM aban_usage_log WHERE guild_id = ? ORDER BY id", (guild_id,))
+    return [row[0] for row in db.cursor.fetchall()]
+
+
+def test_stale_deferred_rows_are_flushed(db, monkeypatch):
+    _make_heavy(db, 1)
+    for target_id in range(3):
+        db.log_aban_usage(1, 100, target_id)
+    assert _logged_targets(db, 1) == []
+
+    # Нагрузка спала: следующая запись идёт напрямую и забирает устаревший буфер
+    db.profiler.reset()
+    monkeypatch.setattr(db, "DEFERRED_MAX_AGE_MS", 0)
+    db.log_aban_usage(1, 100, 3)
+    assert db._deferred_aban_usage == []
+    assert _logged_targets(db, 1) == [0, 1, 2, 3]
+
+
+def test_history_and_archive_see_deferred_rows(db):
+    _make_heavy(db, 1)
+    db.log_aban_usage(1, 100, 7)
+    assert [row["target_id"] for row in db.get_event_history("aban_usage_log", 1)] == [7]
+
+    db.log_aban_usage(1, 100, 8)
+    assert db.archive_events(older_than_ms=-1000) == 2
+    assert db._deferred_aban_usage == []
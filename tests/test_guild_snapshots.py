@@ -0,0 +1,217 @@
+import asyncio
+import itertools
+import sys
+import types
+
+from guild_snapshots import DiscordRestoreClient, SnapshotStore, execute_plan, plan_restore
+
+
+def _role(role_id, name):
+    return {
+        "id": role_id, "name": name, "permissions": 0, "color": 0, "hoist": False,
+        "mentionable": False, "position": 1, "managed": False, "default": False,
+    }
+
+
+def _channel(channel_id, name, channel_type="text", parent_id=None, overwrites=()):
+    return {
+        "id": channel_id, "name": name, "type": channel_type, "position": 0, "parent_id": parent_id,
+        "topic": None, "nsfw": False, "slowmode_delay": 0, "overwrites": list(overwrites),
+    }
+
+
+def _guild_state():
+    overwrite = {"type": "role", "id": 2, "allow": 0, "deny": 1024}
+    member_overwrite = {"type": "member", "id": 77, "allow": 1024, "deny": 0}
+    return {
+        "role:2": _role(2, "muted"),
+        "channel:100": _channel(100, "info", "category", overwrites=[overwrite]),
+        "channel:101": _channel(101, "rules", parent_id=100, overwrites=[member_overwrite, overwrite]),
+        "channel:102": _channel(102, "chat", parent_id=100, overwrites=[overwrite]),
+    }
+
+
+class FakeClient:
+    def __init__(self):
+        self.ids = itertools.count(1000)
+        self.calls = []
+
+    async def create_role(self, guild_id, data):
+        new_id = next(self.ids)
+        self.calls.append(("create_role", new_id, data))
+        return new_id
+
+    async def create_channel(self, guild_id, data):
+        new_id = next(self.ids)
+        self.calls.append(("create_channel", new_id, data))
+        return new_id
+
+    async def edit_role(self, guild_id, role_id, changes):
+        self.calls.append(("edit_role", role_id, changes))
+
+    async def edit_channel(self, guild_id, channel_id, changes):
+        self.calls.append(("edit_channel", channel_id, changes))
+
+
+def _raided(state):
+    # Рейд удалил роль и категорию; у оставшегося канала пропали категория и перезапись роли
+    current = {key: dict(obj) for key, obj in state.items() if key in ("channel:101", "channel:102")}
+    del current["channel:101"]
+    current["channel:102"]["parent_id"] = None
+    current["channel:102"]["overwrites"] = []
+    return current
+
+
+def test_snapshot_roundtrip_and_dedup(db):
+    store = SnapshotStore(db)
+    state = _guild_state()
+    first = store.take_snapshot(1, state)
+    assert store.take_snapshot(1, state) == first
+
+    state["channel:102"] = dict(state["channel:102"], name="general")
+    second = store.take_snapshot(1, state)
+    assert store.load_snapshot(1, second) == state
+    assert store.diff_snapshots(first, second) == {"added": [], "changed": ["channel:102"], "removed": []}
+    assert store.load_snapshot(2, first) is None
+
+
+def _object_count(db, guild_id):
+    db.cursor.execute("SELECT COUNT(*) FROM snapshot_objects WHERE guild_id = ?", (guild_id,))
+    return db.cursor.fetchone()[0]
+
+
+def test_prune_snapshots_keeps_latest(db):
+    store = SnapshotStore(db, keyframe_interval=4)
+    states, ids = [], []
+    state = _guild_state()
+    for i in range(10):
+        state = dict(state, **{"channel:102": dict(state["channel:102"], name=f"chat-{i}")})
+        states.append(state)
+        ids.append(store.take_snapshot(1, state))
+    other = store.take_snapshot(2, _guild_state())
+
+    assert store.prune_snapshots(1, keep=3) == 7
+    assert [s["id"] for s in store.list_snapshots(1)] == ids[:-4:-1]
+    assert store.list_snapshots(1)[-1]["parent_id"] is None
+    for snapshot_id, expected in zip(ids[-3:], states[-3:]):
+        assert store.load_snapshot(1, snapshot_id) == expected
+    assert store.load_snapshot(1, ids[0]) is None
+    # 3 неизменных объекта + 3 версии канала chat
+    assert _object_count(db, 1) == 6
+    assert store.load_snapshot(2, other) == _guild_state()
+
+    state = dict(state, **{"channel:102": dict(state["channel:102"], name="chat-0")})
+    latest = store.take_snapshot(1, state)
+    assert store.load_snapshot(1, latest) == state
+    assert store.prune_snapshots(1, keep=10) == 0
+
+
+def test_execute_plan_remaps_overwrites_and_parents():
+    state = _guild_state()
+    client = FakeClient()
+    result = asyncio.run(execute_plan(plan_restore(state, _raided(state)), client, guild_id=1))
+
+    assert result["failed"] == []
+    role_id = result["id_map"][2]
+    category_id = result["id_map"][100]
+    by_target = {(call[0], call[2].get("name")): call for call in client.calls}
+
+    category = by_target[("create_channel", "info")][2]
+    assert category["overwrites"] == [{"type": "role", "id": role_id, "allow": 0, "deny": 1024}]
+
+    rules = by_target[("create_channel", "rules")][2]
+    assert rules["parent_id"] == category_id
+    assert {"type": "role", "id": role_id, "allow": 0, "deny": 1024} in rules["overwrites"]
+    assert {"type": "member", "id": 77, "allow": 1024, "deny": 0} in rules["overwrites"]
+
+    edit = next(call for call in client.calls if call[0] == "edit_channel")
+    assert edit[1] == 102
+    assert edit[2]["parent_id"] == category_id
+    assert edit[2]["overwrites"] == [{"type": "role", "id": role_id, "allow": 0, "deny": 1024}]
+
+
+def _fake_discord():
+    # Минимальная замена discord.py: только то, что использует DiscordRestoreClient
+    discord = types.ModuleType("discord")
+
+    class Object:
+        def __init__(self, id, type=None):
+            self.id = id
+            self.type = type
+
+    class PermissionOverwrite:
+        @classmethod
+        def from_pair(cls, allow, deny):
+            return (allow, deny)
+
+    discord.Object = Object
+    discord.PermissionOverwrite = PermissionOverwrite
+    discord.Permissions = discord.Colour = int
+    discord.Role = type("Role", (), {})
+    discord.Member = type("Member", (), {})
+    return discord
+
+
+class FakeGuild:
+    # Как и в discord.py, созданные объекты не попадают в кеш гильдии: get_* возвращают None
+    def __init__(self):
+        self.ids = itertools.count(1000)
+        self.created = []
+
+    def get_role(self, role_id):
+        return None
+
+    def get_channel(self, channel_id):
+        return None
+
+    def get_member(self, member_id):
+        return None
+
+    async def create_role(self, **options):
+        role = types.SimpleNamespace(id=next(self.ids), edits=[])
+
+        async def edit(**changes):
+            role.edits.append(changes)
+
+        role.edit = edit
+        self.created.append(("role", role.id, options))
+        return role
+
+    async def _create_channel(self, kind, name, **options):
+        channel = types.SimpleNamespace(id=next(self.ids), edits=[])
+
+        async def edit(**changes):
+            channel.edits.append(changes)
+
+        channel.edit = edit
+        self.created.append((kind, channel.id, dict(options, name=name)))
+        return channel
+
+    async def create_category(self, name, **options):
+        return await self._create_channel("category", name, **options)
+
+    async def create_text_channel(self, name, **options):
+        return await self._create_channel("text", name, **options)
+
+
+def test_discord_client_builds_targets_from_plan(monkeypatch):
+    discord = _fake_discord()
+    monkeypatch.setitem(sys.modules, "discord", discord)
+    guild = FakeGuild()
+    client = DiscordRestoreClient(types.SimpleNamespace(get_guild=lambda guild_id: guild))
+
+    state = _guild_state()
+    current = _raided(state)
+    del current["channel:102"]
+    result = asyncio.run(execute_plan(plan_restore(state, current), client, guild_id=1))
+
+    assert result["failed"] == []
+    role_id = result["id_map"][2]
+    category_id = result["id_map"][100]
+    created = {options["name"]: options for kind, _, options in guild.created if kind != "role"}
+    for name in ("rules", "chat"):
+        assert created[name]["category"].id == category_id
+        role_targets = [target for target in created[name]["overwrites"] if target.type is discord.Role]
+        assert [target.id for target in role_targets] == [role_id]
+    member_targets = [target for target in created["rules"]["overwrites"] if target.type is discord.Member]
+    assert [target.id for target in member_targets] == [77]
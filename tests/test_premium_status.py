@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+from database import from_epoch_ms, now_ms
+
+
+def _stored(db, user_id, guild_id):
+    db.cursor.execute(
+        "SELECT expires_at, typeof(expires_at) FROM premium_status WHERE user_id = ? AND guild_id = ?",
+        (user_id, guild_id)
+    )
+    return db.cursor.fetchone()
+
+
+def test_set_premium_status_stores_epoch_ms(db):
+    expires = datetime.now() + timedelta(days=30)
+    assert db.set_premium_status(1, 10, expires)
+    assert _stored(db, 1, 10) == (int(expires.timestamp() * 1000), "integer")
+    assert db.get_premium_status(1, 10) == {"is_premium": True, "expires_at": int(expires.timestamp() * 1000)}
+    assert db.check_premium_status(1)
+
+
+def test_legacy_text_values_are_normalized(db):
+    future = (datetime.now() + timedelta(days=1)).replace(microsecond=0)
+    past = datetime.now() - timedelta(days=1)
+    rows = [
+        (1, 10, future.strftime('%Y-%m-%d %H:%M:%S')),
+        (2, 10, past.strftime('%Y-%m-%d %H:%M:%S')),
+        (3, 10, "не дата"),
+    ]
+    db.cursor.executemany("INSERT INTO premium_status (user_id, guild_id, expires_at) VALUES (?, ?, ?)", rows)
+    db.connection.commit()
+
+    status = db.get_premium_status(1, 10)
+    assert status["is_premium"] and status["expires_at"] > now_ms()
+    assert _stored(db, 1, 10) == (int(future.timestamp() * 1000), "integer")
+    assert db.get_premium_status(2, 10) == {"is_premium": False, "expires_at": None}
+    assert db.get_premium_status(3, 10) == {"is_premium": False, "expires_at": None}
+    assert _stored(db, 2, 10) is None and _stored(db, 3, 10) is None
+    assert db.check_premium_status(1)
+    assert not db.check_premium_status(2)
+    assert not db.check_premium_status(3)
+
+
+def test_expired_premium_and_conversion_helper(db):
+    expires = datetime.now().replace(microsecond=0) - timedelta(minutes=1)
+    db.set_premium_status(1, 10, expires)
+    assert not db.check_premium_status(1)
+    assert from_epoch_ms(_stored(db, 1, 10)[0]) == expires
+    assert from_epoch_ms(None) is None
@@ -0,0 +1,101 @@
+import pytest
+
+from raid_detector import RaidDetector
+
+DAY = 86400
+START = 1_700_000_000
+
+
+def _joins(guild_id, count, interval, account_age, start=START):
+    return [
+        {"type": "join", "guild_id": guild_id, "time": start + i * interval,
+         "account_created_at": start + i * interval - account_age}
+        for i in range(count)
+    ]
+
+
+def _actions(guild_id, count, interval, kind="channel", start=START):
+    return [{"type": kind, "guild_id": guild_id, "time": start + i * interval} for i in range(count)]
+
+
+def _raid_attempts(db, guild_id):
+    db.cursor.execute("SELECT COUNT(*) FROM raid_attempts WHERE guild_id = ?", (guild_id,))
+    return db.cursor.fetchone()[0]
+
+
+@pytest.fixture
+def detector(db):
+    return RaidDetector(db)
+
+
+def test_join_wave_triggers_at_threshold(db, detector):
+    db.set_protection_status(1, True)
+    triggers = detector.replay(_joins(1, 20, 2, account_age=365 * DAY))
+    assert triggers == [(START + 14 * 2, 1, "join_wave")]
+    assert _raid_attempts(db, 1) == 1
+    assert db.get_freeze_mode(1)
+
+
+def test_joins_below_threshold_do_not_trigger(db, detector):
+    assert detector.replay(_joins(1, 14, 2, account_age=365 * DAY)) == []
+    assert _raid_attempts(db, 1) == 0
+    assert not db.get_freeze_mode(1)
+
+
+def test_young_accounts_trigger_by_ratio(db, detector):
+    db.set_protection_status(1, True)
+    triggers = detector.replay(_joins(1, 6, 5, account_age=3600))
+    assert triggers == [(START + 4 * 5, 1, "young_accounts")]
+    assert detector.get_stats(1, START + 25)["age_distribution"][1] == 6
+    assert db.get_freeze_mode(1)
+
+
+def test_young_accounts_below_ratio(db, detector):
+    # 2 молодых аккаунта из 5 — доля 0.4 меньше порога 0.6
+    trace = _joins(1, 2, 5, account_age=DAY) + _joins(1, 3, 5, account_age=365 * DAY, start=START + 10)
+    assert detector.replay(trace) == []
+    assert _raid_attempts(db, 1) == 0
+
+
+def test_action_burst(db, detector):
+    db.set_protection_status(1, True)
+    trace = _actions(1, 6, 0.5, "channel") + _actions(1, 6, 0.5, "role", start=START + 3)
+    assert detector.replay(trace) == [(START + 3 + 3 * 0.5, 1, "action_burst")]
+    assert _raid_attempts(db, 1) == 1
+    assert db.get_freeze_mode(1)
+
+
+def test_cooldown_suppresses_repeated_triggers(db, detector):
+    trace = (
+        _actions(1, 12, 0.5)
+        + _actions(1, 12, 0.5, start=START + 100)
+        + _actions(1, 12, 0.5, start=START + 400)
+    )
+    triggers = detector.replay(trace)
+    assert [time for time, _, _ in triggers] == [START + 9 * 0.5, START + 400 + 9 * 0.5]
+    assert _raid_attempts(db, 1) == 2
+
+
+def test_trigger_without_protection_only_logs(db, detector):
+    db.set_protection_status(2, False)
+    assert detector.replay(_actions(2, 10, 0.5)) == [(START + 9 * 0.5, 2, "action_burst")]
+    assert _raid_attempts(db, 2) == 1
+    assert not db.get_freeze_mode(2)
+
+
+def test_benign_trace(db, detector):
+    db.set_protection_status(1, True)
+    trace = _joins(1, 200, 30, account_age=365 * DAY) + _actions(1, 300, 20, "role", start=START + 7)
+    trace.sort(key=lambda event: event["time"])
+    assert detector.replay(trace) == []
+    assert _raid_attempts(db, 1) == 0
+    assert not db.get_freeze_mode(1)
+
+
+def test_guilds_are_counted_separately(db, detector):
+    trace = _actions(1, 5, 0.5) + _actions(2, 5, 0.5)
+    trace.sort(key=lambda event: event["time"])
+    assert detector.replay(trace) == []
+    assert detector.get_stats(1, START + 3)["actions"] == 5
+    detector.prune(START + 1000)
+    assert detector.get_stats(1) is None